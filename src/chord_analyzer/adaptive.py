@@ -0,0 +1,71 @@
+import numpy as np
+
+
+GRID = 200
+SLOPE = 3.5
+LAPSE = 0.02
+PRECISION = 0.05
+
+
+def cents(n, d):
+    return 1200 * np.abs(np.log2(np.asarray(n, dtype=float) / np.asarray(d, dtype=float)))
+
+
+def entropy(p):
+    return -np.sum(p * np.log(np.where(p > 0, p, 1.0)), axis=-1)
+
+
+class Quest:
+    # Posterior over a log10 threshold on a grid, Weibull psychometric function as in QUEST;
+    # each stimulus is picked to minimise the expected posterior entropy after the answer
+    slope = SLOPE
+    guess = 0.0
+    lapse = LAPSE
+
+    def __init__(self, levels, grid=GRID, slope=None, guess=None, lapse=None, precision=PRECISION):
+        if slope is not None:
+            self.slope = slope
+        if guess is not None:
+            self.guess = guess
+        if lapse is not None:
+            self.lapse = lapse
+        self.precision = precision
+        self.levels = np.log10(np.asarray(levels, dtype=float))
+        margin = (self.levels.max() - self.levels.min()) / 4 or 0.5
+        self.grid = np.linspace(self.levels.min() - margin, self.levels.max() + margin, grid)
+        self.p = self.psychometric(self.levels[:, None] - self.grid[None, :])
+        self.log_posterior = np.zeros(grid)
+        self.trials = 0
+
+    def psychometric(self, x):
+        return self.guess + (1 - self.guess - self.lapse) * (1 - np.exp(-10 ** (self.slope * x)))
+
+    def posterior(self):
+        p = np.exp(self.log_posterior - self.log_posterior.max())
+        return p / p.sum()
+
+    def update(self, index, positive):
+        p = self.p[index]
+        self.log_posterior += np.log(p if positive else 1 - p)
+        self.trials += 1
+
+    def next(self):
+        post = self.posterior()
+        positive = self.p @ post
+        joint = self.p * post
+        after_positive = joint / positive[:, None]
+        after_negative = (post - joint) / (1 - positive)[:, None]
+        expected = positive * entropy(after_positive) + (1 - positive) * entropy(after_negative)
+        return int(np.argmin(expected))
+
+    def estimate(self):
+        post = self.posterior()
+        mean = post @ self.grid
+        return mean, np.sqrt(post @ (self.grid - mean) ** 2)
+
+    def done(self):
+        return self.estimate()[1] < self.precision
+
+    def threshold(self):
+        mean, sd = self.estimate()
+        return 10 ** mean, sd
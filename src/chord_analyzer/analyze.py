@@ -1,17 +1,49 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+import logging
 import math
+import os
 import numpy as np
 from tabulate import tabulate
 
 
+log = logging.getLogger('analyze')
+
+INT_MAX = np.iinfo(np.int64).max
+CACHE = os.environ.get('CHORD_ANALYZER_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'chord-analyzer'))
+PARALLEL_MIN = 50000
+# Bump when harmonics() or the shell layouts change, so cached tables are recomputed
+CACHE_VERSION = 1
+META = ('size', 'version')
+
+
 def simplify(ratio):
     n, d = ratio
-    gcd = math.gcd(n, d)
-    while gcd > 1:
-        n //= gcd
-        d //= gcd
-        gcd = math.gcd(n, d)
-    return n, d
+    gcd = math.gcd(n, d) or 1
+    return n // gcd, d // gcd
+
+
+def as_ints(values):
+    try:
+        return np.asarray(values, dtype=np.int64)
+    except OverflowError:
+        return np.asarray(values, dtype=object)
+
+
+def multiply(a, b):
+    if a.dtype != object and b.dtype != object and a.size and b.size:
+        bound = int(np.abs(a).max()) * int(np.abs(b).max())
+        if bound <= INT_MAX:
+            return a * b
+    return a.astype(object) * b.astype(object)
+
+
+def simplify_array(nums, dens):
+    nums, dens = as_ints(nums), as_ints(dens)
+    gcd = np.gcd(nums, dens)
+    gcd[gcd == 0] = 1
+    return nums // gcd, dens // gcd
 
 
 def reduce(*harmonics):
@@ -33,54 +65,190 @@ def reduce(*harmonics):
     return stack_a 
 
 
+def reduce_counts(counts):
+    # {2k-1, 2k} -> {k} never overlaps another pair, so merge order does not change the result
+    merged = True
+    while merged:
+        merged = False
+        for v in sorted(counts, reverse=True):
+            if v % 2 == 0 and counts[v] and counts[v - 1]:
+                m = min(counts[v], counts[v - 1])
+                counts[v] -= m
+                counts[v - 1] -= m
+                counts[v // 2] += m
+                merged = True
+    return tuple(sorted(counts.elements()))
+
+
 def get_harmonics(n, d):
-    return reduce(*list(range(d+1, n+1)))
+    return list(harmonics(n, d))
+
+
+@lru_cache(maxsize=65536)
+def harmonics(n, d):
+    # (d+1)/d * ... * n/(n-1) telescopes to n/d; merge the range as a whole, halving it each pass
+    counts = Counter()
+    lo, hi = d + 1, n
+    while lo <= hi:
+        if hi % 2:
+            counts[hi] += 1
+            hi -= 1
+        if lo <= hi and lo % 2 == 0:
+            counts[lo] += 1
+            lo += 1
+        lo, hi = (lo + 1) // 2, hi // 2
+    return reduce_counts(counts)
 
 
 def analyze(*ratios):
-    a_n, a_d = zip(*ratios)
-    input_nums = np.array(a_n)
-    input_dens = np.array(a_d)
-    output_nums = input_nums * input_dens.reshape(input_dens.size, 1)
-    output_dens = input_dens * input_nums.reshape(input_nums.size, 1)
-    func = np.vectorize(lambda x, y: simplify((x, y)))
-    return func(output_nums, output_dens)
+    nums, dens = analyze_batch([ratios])
+    return nums[0], dens[0]
+
+
+def analyze_batch(chords):
+    chords = as_ints(chords)
+    input_nums = chords[..., 0]
+    input_dens = chords[..., 1]
+    output_nums = multiply(input_nums[:, None, :], input_dens[:, :, None])
+    output_dens = multiply(input_dens[:, None, :], input_nums[:, :, None])
+    return simplify_array(output_nums, output_dens)
+
+
+def shell_cells(start, stop):
+    # Cells ordered by shell k = max(i, j): row k, then column k, so a size N table is the first N*N cells
+    i, j = [], []
+    for k in range(start, stop):
+        i += [k] * (k + 1) + list(range(k))
+        j += list(range(k + 1)) + [k] * k
+    return np.array(i, dtype=np.int64), np.array(j, dtype=np.int64)
 
 
-def sum_table(size=12, mode='ratio'):
+def cell_index(i, j):
+    k = max(i, j)
+    return k * k + (j if i == k else k + 1 + i)
+
+
+def table_shells(mode, start, stop):
+    i, j = shell_cells(start, stop)
+    edge = (i == 0) | (j == 0)
+    k = np.maximum(i, j)
+    nums, dens = simplify_array(
+        np.where(edge, k + 1, (i + 1) * (j + 1)),
+        np.where(edge, np.maximum(1, k), i * j),
+    )
+    if mode == 'ratio':
+        return {'nums': nums, 'dens': dens}
+    sizes, values = [], []
+    for n, d in zip(nums.tolist(), dens.tolist()):
+        h = harmonics(n, d)
+        sizes.append(len(h))
+        values.extend(h)
+    return {'sizes': np.array(sizes, dtype=np.int64), 'values': np.array(values, dtype=np.int64)}
+
+
+def resolution_shells(start, stop):
+    h, i_, j_ = [], [], []
+    for j in range(max(1, start), stop):
+        for i in range(1, j + 1):
+            r = harmonics(*simplify((i * j, (i - 1) * (j - 1))))
+            if len(r) == 1:
+                h.append(r[0])
+                i_.append(i)
+                j_.append(j)
+    return {'h': np.array(h, dtype=np.int64), 'i': np.array(i_, dtype=np.int64), 'j': np.array(j_, dtype=np.int64)}
+
+
+def split(start, stop, weight, parts):
+    total = sum(weight(k) for k in range(start, stop))
+    step = max(1, total // parts)
+    a, acc = start, 0
+    for k in range(start, stop):
+        acc += weight(k)
+        if acc >= step:
+            yield a, k + 1
+            a, acc = k + 1, 0
+    if a < stop:
+        yield a, stop
+
+
+def compute(func, start, stop, weight, workers=None):
+    total = sum(weight(k) for k in range(start, stop))
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or total < PARALLEL_MIN:
+        return func(start, stop)
+    bounds = list(split(start, stop, weight, workers * 4))
+    with ProcessPoolExecutor(workers) as pool:
+        chunks = list(pool.map(func, *zip(*bounds)))
+    return {key: np.concatenate([c[key] for c in chunks]) for key in chunks[0]}
+
+
+def compact(a):
+    if not a.size or a.dtype == object or a.min() < 0:
+        return a
+    return a.astype(np.min_scalar_type(a.max()))
+
+
+def cached(name, size, func, weight, cache=CACHE, workers=None):
+    path = os.path.join(cache, f'{name}.npz') if cache else None
+    data, done = {}, 0
+    if path and os.path.exists(path):
+        with np.load(path) as f:
+            if 'version' in f.files and int(f['version']) == CACHE_VERSION:
+                data = {key: f[key].astype(np.int64) for key in f.files if key not in META}
+                done = int(f['size'])
+            else:
+                log.info(f'Discarding {path}: written by another version')
+    if done >= size:
+        return data
+    log.info(f'Computing {name}: {done} -> {size}')
+    new = compute(func, done, size, weight, workers)
+    data = {key: np.concatenate([data[key], new[key]]) if data else new[key] for key in new}
+    if path:
+        os.makedirs(cache, exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, size=size, version=CACHE_VERSION, **{key: compact(a) for key, a in data.items()})
+        os.replace(tmp, path)
+    return data
+
+
+def sum_table(size=12, mode='ratio', cache=CACHE, workers=None):
+    data = cached(f'sum_table-{mode}', size, partial(table_shells, mode), lambda k: 2 * k + 1, cache, workers)
     match mode:
-        case 'ratio': func = lambda n, d: simplify((n, d))
-        case 'harmonics': func = lambda n, d: ','.join(map(str, get_harmonics(*simplify((n, d)))))
+        case 'ratio':
+            nums, dens = data['nums'].tolist(), data['dens'].tolist()
+            func = lambda c: (nums[c], dens[c])
+        case 'harmonics':
+            values = data['values'].tolist()
+            offsets = [0] + np.cumsum(data['sizes']).tolist()
+            func = lambda c: ','.join(map(str, values[offsets[c]:offsets[c + 1]]))
     result = list(['-' for _ in range(size)] for _ in range(size))
     for i in range(size):
         for j in range(size):
-            if j == 0:
-                result[i][j] = func(i+1, max(1, i))
-            elif i == 0:
-                result[i][j] = func(j+1, max(1, j))
+            r = func(cell_index(i, j))
+            if i == 0 or j == 0:
+                result[i][j] = r
             else:
-                r = func((i+1)*(j+1), i*j)
                 result[i][j] = r if len(r) < 2 else '.'
     return result
 
 
-def resolutions(size=12):
+def resolutions(size=12, cache=CACHE, workers=None):
+    data = cached('resolutions', size + 1, resolution_shells, lambda j: j, cache, workers)
+    keep = data['j'] <= size
+    h, i, j = data['h'][keep], data['i'][keep], data['j'][keep]
     result = defaultdict(list)
-    for i in range(1, size+1):
-        for j in range(i, size+1):
-            n, d = i * j, (i - 1) * (j - 1)
-            h = get_harmonics(*simplify((n, d)))
-            if len(h) == 1:
-                result[h[0]].append((i, j))
+    for k in np.lexsort((j, i)).tolist():
+        result[int(h[k])].append((int(i[k]), int(j[k])))
     return result
 
 
-def print_sum_table(mode='harmonics'):
-    print(tabulate(sum_table(mode)))
+def print_sum_table(size=12, mode='harmonics', **options):
+    print(tabulate(sum_table(size=size, mode=mode, **options)))
 
 
-def print_resolutions(size):
-    r = resolutions(size)
+def print_resolutions(size, **options):
+    r = resolutions(size, **options)
     for i in range(2, 17):
         print(f'{i}: {r[i]}')
 
@@ -95,8 +263,13 @@ def print_negatives(size):
         print(f'-{i} = {harmonics}')
 
 
-print_resolutions(64)
-print('\n', '*' * 64, '\n')
-print(tabulate(sum_table(size=32, mode='harmonics')))
-print('\n', '*' * 64, '\n')
-print_negatives(16)
+def print_report(resolutions_size=64, table_size=32, negatives_size=16, **options):
+    print_resolutions(resolutions_size, **options)
+    print('\n', '*' * 64, '\n')
+    print_sum_table(size=table_size, mode='harmonics', **options)
+    print('\n', '*' * 64, '\n')
+    print_negatives(negatives_size)
+
+
+if __name__ == "__main__":
+    print_report()
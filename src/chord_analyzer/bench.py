@@ -0,0 +1,157 @@
+import argparse
+from contextlib import redirect_stdout
+from dataclasses import replace
+import io
+import json
+import logging
+import os
+import platform
+from time import perf_counter
+import tracemalloc
+
+from .__about__ import __version__
+from .clock import Clock, VirtualClock
+from . import gen_frm
+from .play_frm import Compiler, FrmPlayer, Sleep, Sync, get_file, get_parser
+from .ports import RecordingPort
+
+
+log = logging.getLogger('bench')
+
+# Only there in a source checkout; installed copies take the score with --synth1
+SYNTH1 = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', 'music', 'frm', 'synth1.frm'))
+SCALES = (1, 4, 16, 64)
+REPEAT = 3
+BUDGET = 1.0
+
+
+def synth1_score(scale, filename=SYNTH1):
+    return get_file(filename) * scale
+
+
+def chords_score(scale, key=gen_frm.major):
+    chords = [
+        [key.get_note(i % len(key) + k) for k in (0, 2, 4, 7)]
+        for i in range(60 * scale)
+    ]
+    out = io.StringIO()
+    with redirect_stdout(out):
+        gen_frm.play_chords(*chords)
+    return out.getvalue()
+
+
+SCORES = {
+    'synth1': synth1_score,
+    'chords': chords_score,
+}
+
+
+def best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t = perf_counter()
+        result = fn()
+        times.append(perf_counter() - t)
+    return min(times), result
+
+
+def dispatch(parser, events):
+    clock = VirtualClock()
+    port = RecordingPort(clock)
+    player = FrmPlayer(parser, clock=clock, port=port)
+    player.play(events)
+    player.stop()
+    return clock.position, port
+
+
+def compressed(events, speed):
+    for event in events:
+        match event:
+            case Sleep(seconds):
+                yield replace(event, seconds=seconds / speed)
+            case Sync(target):
+                yield replace(event, target=target / speed)
+            case _:
+                yield event
+
+
+def peak_memory(parser, data):
+    tracemalloc.start()
+    try:
+        events = list(Compiler().compile(parser.parse(data)))
+        dispatch(parser, events)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(parser, data, repeat=REPEAT, budget=BUDGET):
+    parse_time, tree = best(lambda: parser.parse(data), repeat)
+    compile_time, events = best(lambda: list(Compiler().compile(tree)), repeat)
+    dispatch_time, (duration, port) = best(lambda: dispatch(parser, events), repeat)
+
+    speed = max(1.0, duration / budget)
+    clock = Clock()
+    player = FrmPlayer(parser, clock=clock, port=RecordingPort(clock))
+    player.play(compressed(events, speed))
+    player.stop()
+
+    return {
+        'bytes': len(data),
+        'events': len(events),
+        'messages': port.stats()['messages'],
+        'duration': duration,
+        'parse': parse_time,
+        'compile': compile_time,
+        'dispatch': dispatch_time,
+        'events_per_second': len(events) / dispatch_time if dispatch_time else None,
+        'peak_memory': peak_memory(parser, data),
+        'speed': speed,
+        'lateness': clock.report(),
+    }
+
+
+def run(scores=tuple(SCORES), scales=SCALES, repeat=REPEAT, budget=BUDGET, synth1=SYNTH1):
+    parser = get_parser()
+    options = {'synth1': {'filename': synth1}}
+    results = []
+    for name in scores:
+        for scale in scales:
+            log.info(f'Benchmarking: {name} x{scale}')
+            result = measure(parser, SCORES[name](scale, **options.get(name, {})), repeat, budget)
+            results.append({'score': name, 'scale': scale, **result})
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Benchmark FRM parsing, compilation and playback')
+    parser.add_argument("--score", choices=tuple(SCORES), action='append', help='Scores to benchmark (default: all)')
+    parser.add_argument("--scale", type=int, action='append', help=f'Score repetitions (default: {", ".join(map(str, SCALES))})')
+    parser.add_argument("--repeat", type=int, default=REPEAT, help='Runs per timing, the best one is kept')
+    parser.add_argument("--budget", type=float, default=BUDGET, help='Seconds of real-time playback per score for lateness')
+    parser.add_argument("--synth1", default=SYNTH1, help='Path to music/frm/synth1.frm (default: the one in the source checkout)')
+    parser.add_argument("-o", "--output", help='Write JSON here instead of stdout')
+    parser.add_argument("-v", "--verbose", action='store_true', help='Enable progress logging')
+    args = parser.parse_args()
+    scores = args.score or tuple(SCORES)
+    if 'synth1' in scores and not os.path.exists(args.synth1):
+        parser.error(f'{args.synth1} not found: pass the score with --synth1, or leave it out with --score chords')
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    report = run(
+        scores=scores,
+        scales=args.scale or SCALES,
+        repeat=args.repeat,
+        budget=args.budget,
+        synth1=args.synth1,
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
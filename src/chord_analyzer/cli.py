@@ -0,0 +1,152 @@
+import argparse
+import logging
+import os
+
+from .options import add_player, add_port, player_options
+
+
+log = logging.getLogger('cli')
+
+
+def play(args):
+    from .ports import open_port
+
+    options = player_options(args)
+    port = open_port(args.port)
+    try:
+        if not args.filename:
+            from .play_frm import run_cli
+
+            run_cli(port=port, **options)
+        elif args.together:
+            import asyncio
+            from .engine import Engine
+
+            asyncio.run(Engine(port=port, **options).run(*args.filename, stream=args.stream))
+        else:
+            from .play_frm import run_file
+
+            for filename in args.filename:
+                if os.path.splitext(filename)[1] == '.chr':
+                    play_chr(filename, port, args.verbose)
+                else:
+                    run_file(filename, stream=args.stream, port=port, **options)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        port.close()
+        if hasattr(port, 'stats'):
+            log.info('Port: %s', port.stats())
+
+
+def play_chr(filename, port, verbose=False):
+    from .play_chr import ChrPlayer
+
+    log.info(f'Running: {filename}')
+    player = ChrPlayer(port=port, verbose=verbose)
+    try:
+        log.info('Lateness: %s', player.run(filename))
+    finally:
+        player.all_stop()
+
+
+def export(args):
+    from .play_frm import export_file
+
+    for filename in args.filename:
+        export_file(filename, stream=args.stream, **player_options(args))
+
+
+def render(args):
+    from .synth import render_file
+
+    options = {} if args.rate is None else {'rate': args.rate}
+    for filename in args.filename:
+        render_file(filename, stream=args.stream, **player_options(args), **options)
+
+
+def analyze(args):
+    from .analyze import print_report
+
+    options = {'workers': args.workers}
+    if args.no_cache:
+        options['cache'] = None
+    elif args.cache:
+        options['cache'] = args.cache
+    print_report(args.resolutions, args.table, args.negatives, **options)
+
+
+def view(args):
+    from .view import plot
+
+    plot(args.kind, args.filename)
+
+
+def convert(args):
+    from .results import convert
+
+    for filename in args.filename:
+        convert(filename, kind=args.kind)
+
+
+def live(args):
+    from .player import run
+
+    run()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser('chord-analyzer')
+    parser.add_argument("-v", "--verbose", action='store_true', help='Enable debug logging')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('play', help='Play FRM and CHR files, or FRM commands from stdin')
+    p.add_argument("filename", metavar='filename', nargs="*", help='Filenames to play; .chr files use the CHR player')
+    p.add_argument("--together", action='store_true', help='Play all FRM files at once on a shared port')
+    add_player(p)
+    add_port(p)
+    p.set_defaults(func=play)
+
+    p = commands.add_parser('export', help='Write FRM files to .mid next to them')
+    p.add_argument("filename", metavar='filename', nargs="+", help='Filenames to export')
+    add_player(p, timing=False)
+    p.set_defaults(func=export)
+
+    p = commands.add_parser('render', help='Render FRM files to .wav next to them')
+    p.add_argument("filename", metavar='filename', nargs="+", help='Filenames to render')
+    p.add_argument("--rate", type=int, help='Sample rate (default: 44100)')
+    add_player(p, steal=False, timing=False)
+    p.set_defaults(func=render)
+
+    p = commands.add_parser('analyze', help='Print resolution, harmonic sum and negative harmonic tables')
+    p.add_argument("--resolutions", type=int, default=64, help='Largest harmonic pair to resolve')
+    p.add_argument("--table", type=int, default=32, help='Harmonic sum table size')
+    p.add_argument("--negatives", type=int, default=16, help='Largest negative harmonic')
+    p.add_argument("--workers", type=int, help='Processes used to fill in tables (default: one per CPU)')
+    p.add_argument("--cache", help='Directory for computed tables (default: $CHORD_ANALYZER_CACHE or ~/.cache/chord-analyzer)')
+    p.add_argument("--no-cache", action='store_true', help='Compute tables without reading or writing the cache')
+    p.set_defaults(func=analyze)
+
+    p = commands.add_parser('view', help='Plot listening test results')
+    p.add_argument("kind", choices=('min', 'max'), help='Which interval test to plot')
+    p.add_argument("filename", nargs="?", help='Results file, .res or .bres (default: <kind>_interval.bres, or <kind>_interval.res if there is none)')
+    p.set_defaults(func=view)
+
+    p = commands.add_parser('convert', help='Convert .res listening test results to the binary .bres format')
+    p.add_argument("filename", metavar='filename', nargs="+", help='Result files to convert')
+    p.add_argument("--kind", choices=('compare', 'min', 'max'), help='Experiment type (default: guessed from the file name)')
+    p.set_defaults(func=convert)
+
+    p = commands.add_parser('live', help='Play harmonics from the keyboard (needs pygame)')
+    p.set_defaults(func=live)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
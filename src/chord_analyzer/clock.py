@@ -0,0 +1,84 @@
+from array import array
+import asyncio
+import time
+
+
+SPIN = 0.001
+
+
+class Clock:
+    spin = SPIN
+
+    def __init__(self, spin=None):
+        if spin is not None:
+            self.spin = spin
+        self.lateness = array('d')
+        self.start()
+
+    def start(self, origin=None):
+        self.origin = time.perf_counter() if origin is None else origin
+        self.position = 0.0
+
+    def now(self):
+        return time.perf_counter() - self.origin
+
+    def advance(self, seconds):
+        self.position += seconds
+        return self.position
+
+    def sync(self, target):
+        self.position = max(self.position, target)
+        return self.position
+
+    def wait_until(self, target):
+        deadline = self.origin + target
+        remaining = deadline - time.perf_counter()
+        if remaining > self.spin:
+            time.sleep(remaining - self.spin)
+        now = time.perf_counter()
+        while now < deadline:
+            now = time.perf_counter()
+        late = now - deadline
+        self.lateness.append(late)
+        return late
+
+    async def wait_until_async(self, target):
+        deadline = self.origin + target
+        remaining = deadline - time.perf_counter()
+        if remaining > self.spin:
+            await asyncio.sleep(remaining - self.spin)
+        now = time.perf_counter()
+        while now < deadline:
+            await asyncio.sleep(0)
+            now = time.perf_counter()
+        late = now - deadline
+        self.lateness.append(late)
+        return late
+
+    def report(self):
+        if not self.lateness:
+            return {'events': 0}
+        ordered = sorted(self.lateness)
+        return {
+            'events': len(ordered),
+            'mean': sum(ordered) / len(ordered),
+            'p50': ordered[len(ordered) // 2],
+            'p99': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+            'max': ordered[-1],
+        }
+
+
+class VirtualClock(Clock):
+
+    def start(self, origin=None):
+        self.origin = 0.0
+        self.position = 0.0
+
+    def now(self):
+        return self.position
+
+    def wait_until(self, target):
+        return 0.0
+
+    async def wait_until_async(self, target):
+        return 0.0
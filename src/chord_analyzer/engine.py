@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+import logging
+from time import perf_counter
+
+from .clock import Clock
+from .options import add_player, add_port, player_options
+from .play_frm import ChannelRegistry, FrmPlayer, get_parser, load, log_report
+from .ports import get_port, open_port
+
+
+log = logging.getLogger('engine')
+
+
+class Engine:
+
+    def __init__(self, port=None, channels=None, steal=None, priorities=None, **options):
+        self.parser = get_parser()
+        log.info('Opening port')
+        self.port = port or get_port()
+        self.channels = channels or ChannelRegistry(policy=steal, priorities=priorities)
+        self.options = options
+        self.tasks = set()
+
+    def player(self):
+        return FrmPlayer(
+            self.parser,
+            clock=Clock(),
+            port=self.port,
+            channels=self.channels,
+            **self.options
+        )
+
+    def start(self, player, events, origin=None):
+        task = asyncio.create_task(self._run(player, events, origin))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def add(self, filename, stream=False, origin=None):
+        log.info(f'Adding: {filename}')
+        player = self.player()
+        return self.start(player, load(player, filename, stream), origin)
+
+    async def _run(self, player, events, origin):
+        try:
+            await player.play_async(events, origin)
+        finally:
+            # The registry and tracer are shared, so run() reports them once for all scores
+            player.stop(report=False)
+
+    def cancel(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+    async def join(self):
+        while self.tasks:
+            done, _ = await asyncio.wait(list(self.tasks))
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    log.error('Score failed', exc_info=task.exception())
+
+    async def run(self, *filenames, stream=False):
+        scores = []
+        for filename in filenames:
+            log.info(f'Loading: {filename}')
+            player = self.player()
+            scores.append((player, load(player, filename, stream)))
+        origin = perf_counter()
+        for player, events in scores:
+            self.start(player, events, origin)
+        await self.join()
+        log_report(self.channels, self.options.get('tracer'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Play FRM files simultaneously')
+    parser.add_argument("filename", metavar='filename', nargs="+", help='Filenames to play together')
+    add_player(parser)
+    add_port(parser)
+    parser.add_argument("-v", "--verbose", action='store_true', help='Enable debug logging')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    engine = Engine(port=open_port(args.port), **player_options(args))
+    try:
+        asyncio.run(engine.run(*args.filename, stream=args.stream))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.port.close()
+        if hasattr(engine.port, 'stats'):
+            log.info('Port: %s', engine.port.stats())
@@ -0,0 +1,85 @@
+from collections import defaultdict, deque
+from time import perf_counter
+
+
+BUCKETS = 32
+TRACE_LIMIT = 100000
+
+
+class Histogram:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        i = min(BUCKETS - 1, max(0, int(seconds * 1e6)).bit_length())
+        self.buckets[i] += 1
+
+    def percentile(self, q):
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return min(self.max, (2**i) / 1e6)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class Tracer:
+
+    def __init__(self, trace=False, limit=TRACE_LIMIT):
+        self.histograms = defaultdict(Histogram)
+        self.events = deque(maxlen=limit) if trace else None
+
+    def time(self, key, seconds):
+        self.histograms[key].add(seconds)
+
+    def trace(self, *item):
+        if self.events is not None:
+            self.events.append((perf_counter(), item))
+
+    def timed(self, key, iterable):
+        it = iter(iterable)
+        histogram = self.histograms[key]
+        while True:
+            t = perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            histogram.add(perf_counter() - t)
+            yield item
+
+    def report(self):
+        return {k: h.summary() for k, h in sorted(self.histograms.items())}
+
+    def format_report(self):
+        for key, s in self.report().items():
+            yield (
+                f'{key:<24} n={s["count"]:<8} mean={s["mean"]*1e6:9.1f}us '
+                f'p50<={s["p50"]*1e6:9.1f}us p99<={s["p99"]*1e6:9.1f}us '
+                f'max={s["max"]*1e6:9.1f}us'
+            )
+
+    def format_trace(self, formatter=repr):
+        if not self.events:
+            return
+        start = self.events[0][0]
+        for t, item in self.events:
+            yield f'{(t - start)*1000:10.3f}ms ' + ' '.join(map(formatter, item))
@@ -0,0 +1,42 @@
+import argparse
+
+
+# Kept free of lark and mido so the entry point can build its parser cheaply
+STEAL = ('oldest', 'quietest', 'priority')
+BACKENDS = ('fluid', 'null', 'record', 'file:<path.mid>', '<mido output name>')
+
+
+def priority(value):
+    prog, sep, n = value.partition('=')
+    try:
+        if not sep:
+            raise ValueError
+        return int(prog), int(n)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected PROG=N, got {value!r}')
+
+
+def add_port(parser):
+    parser.add_argument("--port", help=f'Output port: {", ".join(BACKENDS)} (default: fluid)')
+
+
+def add_player(parser, steal=True, timing=True):
+    parser.add_argument("--retune", action='store_true', help='Re-pitch sounding notes when a note they depend on changes')
+    if steal:
+        parser.add_argument("--steal", choices=STEAL, default='oldest', help='Which note loses its channel when all are taken')
+        parser.add_argument("--priority", type=priority, action='append', metavar='PROG=N', help='Channel priority of a MIDI program for --steal priority, lower is stolen first (repeatable, default: 0)')
+    parser.add_argument("--stream", action='store_true', help='Parse files line by line instead of compiling them up front')
+    if timing:
+        parser.add_argument("--timing", action='store_true', help='Report per-command timing histograms on stop')
+        parser.add_argument("--trace", action='store_true', help='Also log every event and message sent, with timestamps')
+
+
+def player_options(args):
+    options = {'retune': args.retune}
+    if 'steal' in args:
+        options.update(steal=args.steal, priorities=dict(args.priority or ()))
+    if 'timing' in args and (args.timing or args.trace):
+        from .instrument import Tracer
+
+        options['tracer'] = Tracer(trace=args.trace)
+    return options
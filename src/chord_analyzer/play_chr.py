@@ -1,8 +1,16 @@
+import argparse
+from functools import lru_cache
 import math
+import sys
 import time
 import traceback
 
 import mido
+import numpy as np
+
+from .clock import Clock
+from .options import add_port
+from .ports import get_port, open_port
 
 
 A4 = 440.0
@@ -13,22 +21,29 @@ bend_limit = 2**13
 bend_semitones = 2.0
 
 
-def get_port():
-    return mido.open_output(
-        [o for o in mido.get_output_names() if o.startswith('FLUID')][0]
-    )
+@lru_cache(maxsize=4096)
+def freq_to_midi(freq):
+    semitones = math.log2(freq/A4)*12 + A4_code
+    note = round(semitones)
+    bend = round(bend_limit / bend_semitones * (semitones - note))
+    return note, max(-bend_limit, min(bend_limit - 1, bend))
 
 
-def freq_to_midi(freq):
-    note = int(math.log2(freq/A4)*12 + A4_code)
-    bend = int(bend_limit * 12.0 / bend_semitones * math.log2(freq/midi_to_freq(note, 0)))
-    return note, bend
+def freqs_to_midi(freqs):
+    semitones = np.log2(np.asarray(freqs, dtype=float)/A4)*12 + A4_code
+    notes = np.rint(semitones)
+    bends = np.rint(bend_limit / bend_semitones * (semitones - notes))
+    return notes.astype(int), np.clip(bends, -bend_limit, bend_limit - 1).astype(int)
 
 
 def midi_to_freq(note, bend):
     return (A4 * 2.0**((note-A4_code)/12) *  2**((bend_semitones/12)*(bend/bend_limit)))
 
 
+def midis_to_freq(notes, bends):
+    return midi_to_freq(np.asarray(notes, dtype=float), np.asarray(bends, dtype=float))
+
+
 class Interval:
     n: int = 1
     d: int = 1
@@ -38,24 +53,85 @@ class Interval:
         self.n = n
         self.d = d
         self.parent = parent
+        self.children = set()
+        self._cached = None
+
+    def attach(self):
+        if self.parent is not None:
+            self.parent.children.add(self)
+        return self
+
+    def detach(self):
+        if self.parent is not None:
+            self.parent.children.discard(self)
+
+    def assign(self, other):
+        ancestor = other.parent
+        while ancestor is not None:
+            if ancestor is self:
+                raise ValueError('Interval can\'t depend on itself')
+            ancestor = ancestor.parent
+        self.detach()
+        self.n, self.d, self.parent, self._freq = other.n, other.d, other.parent, other._freq
+        self.attach()
+        self.invalidate()
+
+    def invalidate(self):
+        stack = [self]
+        while stack:
+            i = stack.pop()
+            i._cached = None
+            stack.extend(i.children)
 
     def set_freq(self, freq: float):
-        if self.n != 1 or self.d != 1:
+        if self.parent is not None:
             raise ValueError('Can only set frequency on the root')
         self._freq = freq
+        self.invalidate()
 
     def freq(self):
-        if self.n == 1 and self.d == 1:
-            return self._freq
-        return self.parent.freq() * float(self.n) / float(self.d)
+        if self._cached is None:
+            if self.parent is None:
+                self._cached = self._freq
+            else:
+                self._cached = self.parent.freq() * float(self.n) / float(self.d)
+        return self._cached
+
+
+def compile_chr(lines):
+    events = []
+    t = 0.0
+    for line in lines:
+        cmd, *args = line.rstrip('\n').split(' ')
+        # 'i' prints the player state, which only makes sense at the interactive prompt
+        if cmd.startswith('#') or cmd == 'i':
+            continue
+        if cmd == 'sleep':
+            t += float(args[0])
+            continue
+        events.append((t, cmd, args))
+    return events
+
+
+class Capture:
+
+    def __init__(self):
+        self.messages = []
+
+    def send(self, msg):
+        self.messages.append(msg)
 
 
 class ChrPlayer:
-    index = {}
+    verbose = True
 
-    def __init__(self, freq=220.0):
-        self.port = get_port()
+    def __init__(self, freq=220.0, port=None, clock=None, verbose=None):
+        self.port = port or get_port()
+        self.clock = clock or Clock()
+        if verbose is not None:
+            self.verbose = verbose
         self.b0 = Interval(1, 1)
+        self.index = {}
 
     def _names(self, names):
         for name in names:
@@ -65,19 +141,32 @@ class ChrPlayer:
             yield name, v
 
     def _send(self, cmd, *args, **kwargs):
-        print(cmd, args, kwargs)
+        if self.verbose:
+            print(cmd, args, kwargs)
         self.port.send(mido.Message(cmd, *args, **kwargs))
 
     def play(self, *names):
         for _, v in self._names(names):
             note, bend = freq_to_midi(v['interval'].freq())
-            self._send('note_on', channel=v['channel'], note=note, velocity=127)
             self._send('pitchwheel', channel=v['channel'], pitch=bend)
+            self._send('note_on', channel=v['channel'], note=note, velocity=127)
             v['note'] = note
 
+    def midi_state(self):
+        values = list(self.index.values())
+        notes, bends = freqs_to_midi([v['interval'].freq() for v in values])
+        return [
+            (v['channel'], int(note), int(bend))
+            for v, note, bend in zip(values, notes, bends)
+        ]
+
     def all_play(self):
-        for name in self.index:
-            self.play(name)
+        if not self.index:
+            return
+        for v, (channel, note, bend) in zip(self.index.values(), self.midi_state()):
+            self._send('pitchwheel', channel=channel, pitch=bend)
+            self._send('note_on', channel=channel, note=note, velocity=127)
+            v['note'] = note
 
     def stop(self, *names):
         for _, v in self._names(names):
@@ -93,17 +182,18 @@ class ChrPlayer:
     def add_note(self, name, channel, interval):
         self.index[name] = {
             'channel': channel,
-            'interval': interval,
+            'interval': interval.attach(),
             'note': None
         }
 
     def change_note(self, name, interval):
-        self.index[name]['interval'] = interval
+        self.index[name]['interval'].assign(interval)
 
     def remove_note(self, *names):
         for name, v in self._names(names):
             if v['note'] is not None:
-                self._stop(name)
+                self.stop(name)
+            v['interval'].detach()
             del self.index[name]
 
     def program_change(self, program, *names):
@@ -138,7 +228,6 @@ class ChrPlayer:
             case 'as':
                 self.all_stop()
             case 'a':
-                print()
                 self.add_note(
                     args[0], int(args[1]), self.get_interval(args[2])
                 )
@@ -156,9 +245,55 @@ class ChrPlayer:
                 self.all_stop()
                 self.all_play()
 
-
-if __name__ == "__main__":
-    player = ChrPlayer(220.0)
+    def prepare(self, lines):
+        # Resolve every command to MIDI messages, grouped by start time, before anything is sent
+        port, verbose = self.port, self.verbose
+        capture = self.port = Capture()
+        self.verbose = False
+        schedule = []
+        try:
+            for t, cmd, args in compile_chr(lines):
+                start = len(capture.messages)
+                try:
+                    self.process(cmd, args)
+                except Exception as e:
+                    raise ValueError(f'Failed to parse: {" ".join([cmd, *args])}') from e
+                if schedule and schedule[-1][0] == t:
+                    schedule[-1][1].extend(capture.messages[start:])
+                else:
+                    schedule.append((t, capture.messages[start:]))
+        finally:
+            self.port, self.verbose = port, verbose
+        return schedule
+
+    def run(self, source):
+        if isinstance(source, str):
+            with open(source, 'r') as f:
+                schedule = self.prepare(f)
+        else:
+            schedule = self.prepare(source)
+        sounding = set()
+        self.clock.start()
+        try:
+            for t, messages in schedule:
+                self.clock.wait_until(t)
+                for msg in messages:
+                    if self.verbose:
+                        print(msg)
+                    self.port.send(msg)
+                    if msg.type == 'note_on':
+                        sounding.add((msg.channel, msg.note))
+                    elif msg.type == 'note_off':
+                        sounding.discard((msg.channel, msg.note))
+        except BaseException:
+            # The note state already describes the end of the script, so silence what was really sent
+            for channel, note in sounding:
+                self.port.send(mido.Message('note_off', channel=channel, note=note))
+            raise
+        return self.clock.report()
+
+
+def run_cli(player):
     while True:
         try:
             inp = input('command: ').split(' ')
@@ -175,4 +310,28 @@ if __name__ == "__main__":
         except Exception as e:
             print(f'Failed to parse: {inp}')
             traceback.print_exc()
-    player.all_stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Play CHR files')
+    parser.add_argument("filename", metavar='filename', nargs="*", help='Filenames to play, - for stdin; piped stdin is played on the clock, a terminal gets a prompt')
+    parser.add_argument("-q", "--quiet", action='store_true', help='Do not print sent messages')
+    add_port(parser)
+    args = parser.parse_args()
+    port = open_port(args.port)
+    player = ChrPlayer(220.0, port=port, verbose=not args.quiet)
+    try:
+        if args.filename:
+            for filename in args.filename:
+                print(f'# Lateness: {player.run(sys.stdin if filename == "-" else filename)}')
+        elif not sys.stdin.isatty():
+            print(f'# Lateness: {player.run(sys.stdin)}')
+        else:
+            run_cli(player)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        player.all_stop()
+        port.close()
+        if hasattr(port, 'stats'):
+            print(f'# Port: {port.stats()}')
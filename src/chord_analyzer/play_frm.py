@@ -1,94 +1,76 @@
 import argparse
-from dataclasses import dataclass
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from fractions import Fraction
 from typing import *
 import logging
-from time import sleep
+import os
+from time import perf_counter
 import traceback
 
 import mido
-from lark import Lark, Token, Tree, UnexpectedCharacters
+from lark import Lark, UnexpectedInput
 
-from play_chr import get_port, freq_to_midi
+from .clock import Clock, VirtualClock
+from .options import STEAL, add_player, add_port, player_options
+from .play_chr import freq_to_midi
+from .ports import MidiFilePort, get_port, open_port
 
 
-logging.basicConfig()
-logging.getLogger().setLevel(logging.DEBUG)
 log = logging.getLogger('play_frm')
 
 
-def get_parser(filename="frm.lark"):
-    with open(filename, 'r') as f:
-        return Lark(f.read())
+def get_parser(filename="frm.lark", cache=True):
+    return Lark.open(filename, rel_to=__file__, parser='lalr', cache=cache)
 
 
 def get_file(filename):
     with open(filename, 'r') as f:
-        data = f.read()
-
-    while data[-2] == '\n':
-        data = data[:-1]
-
-    if data[-1] != '\n':
-        data += '\n'
-
-    return data
-
-
-class TreeList:
-    def __init__(self, tree):
-        self._tree = []
-        self._kwds = {}
-        for c in tree.children:
-            if isinstance(c, Tree):
-                k = c.data.value
-                val = TreeList(c)
-                if len(list(val)) == 1 and not isinstance(val[0], tuple):
-                    val = val[0]
-                if k not in self._kwds:
-                    self._kwds[c.data.value] = val
-                elif isinstance(self._kwds[k], list):
-                    self._kwds[k].append(val)
-                else:
-                    self._kwds[k] = [self._kwds[k], val]
-                self._tree.append((c.data.value, val))
-            elif isinstance(c, Token):
-                self._tree.append(c.value)
-            else:
-                self._tree.append(c)
-
-    def __getitem__(self, k):
-        if isinstance(k, int):
-            return self._tree[k]
-        if k not in self._kwds:
-            raise ValueError(f'Unknown key: {k}')
-        itm = self._kwds[k]
-        if isinstance(itm, tuple):
-            return itm[1]
-        return itm
-
-    def __repr__(self):
-        return f'TreeList({self._tree})'
-
-    def __iter__(self):
-        return iter(self._tree)
-
-    def __contains__(self, k):
-        return k in self._kwds
-
-
-def one_or_many(v):
-    if isinstance(v, list):
-        return v
-    return [v]
+        return f.read().rstrip('\n') + '\n'
 
 
-@dataclass
-class Frequency:
+def iter_lines(filename):
+    with open(filename, 'r') as f:
+        for line in f:
+            yield line if line.endswith('\n') else line + '\n'
+
+
+def harmonic_ratio(octave, harmonics):
+    total_n, total_d = 1, 1
+    for n in harmonics:
+        d = max(1, n-1)
+        total_n *= n
+        total_d *= d
+    octave = octave or 0
+    return (2**octave) * total_n / total_d
+
+
+@dataclass(eq=False)
+class Node:
+    children: set = field(default_factory=set, repr=False, kw_only=True)
+
+    def invalidate(self):
+        affected = []
+        stack = list(self.children)
+        while stack:
+            note = stack.pop()
+            note._freq = None
+            affected.append(note)
+            stack.extend(note.children)
+        return affected
+
+
+@dataclass(eq=False)
+class Frequency(Node):
     frequency: float = None
 
     def freq(self):
         return self.frequency
 
+    def set_frequency(self, frequency):
+        self.frequency = frequency
+        return self.invalidate()
+
 
 @dataclass
 class Sound:
@@ -97,73 +79,96 @@ class Sound:
     velocity: int
 
 
-@dataclass
-class Note:
+@dataclass(eq=False)
+class Note(Node):
     parent: Frequency = None
-    octave: int = 0
-    harmonics: list[int] = None
+    ratio: float = 1.0
     sound: Sound = None
     program: int = None
+    _freq: float = field(default=None, repr=False, kw_only=True)
+
+    def __post_init__(self):
+        if self.parent is not None:
+            self.parent.children.add(self)
 
     def freq(self):
-        total_n, total_d = 1, 1
-        for n in self.harmonics:
-            d = max(1, n-1)
-            total_n *= n
-            total_d *= d
-        octave = self.octave or 0
-        return self.parent.freq() * (2**octave) * total_n / total_d
+        if self._freq is None:
+            self._freq = self.parent.freq() * self.ratio
+        return self._freq
 
+    def set_parent(self, parent, ratio):
+        if parent is not self.parent:
+            self.parent.children.discard(self)
+            parent.children.add(self)
+            self.parent = parent
+        self.ratio = ratio
+        self._freq = None
+        return self.invalidate()
 
-CHANNELS_NUM = 16
 
+@dataclass(frozen=True, slots=True)
+class SetProgram:
+    program: int
 
-class ChannelRegistry:
-    channels = None
 
-    def __init__(self, max_channels=None):
-        self.channels = [False for _ in range(max_channels or CHANNELS_NUM)]
+@dataclass(frozen=True, slots=True)
+class SetNoteProgram:
+    slot: int
+    program: int
 
-    def allocate(self):
-        for i, occupied in enumerate(self.channels):
-            if not occupied:
-                self.channels[i] = True
-                return i
-        return None
 
-    def free(self, i):
-        self.channels[i] = False
+@dataclass(frozen=True, slots=True)
+class NewFrequency:
+    slot: int
+    frequency: float
 
 
-class FrmPlayer:
-    bpm = 120
-    program = 85
-    signature = (4, 4)
+@dataclass(frozen=True, slots=True)
+class NewNote:
+    slot: int
+    parent: int
+    ratio: float
 
-    frequencies = {}
-    notes = {}
 
-    port = None
-    channels = None
+@dataclass(frozen=True, slots=True)
+class NoteOn:
+    slot: int
 
-    running = False
 
-    def __init__(self, parser):
-        log.info('Initializing player')
-        self.parser = parser
-        log.info('Opening port')
-        self.port = get_port()
-        self.channels = ChannelRegistry()
+@dataclass(frozen=True, slots=True)
+class NoteOff:
+    slot: int
 
-    def _send(self, cmd, *args, **kwargs):
-        log.debug(f"Sending to port: {cmd} {args}, {kwargs}")
-        self.port.send(mido.Message(cmd, *args, **kwargs))
 
-    def get_frequency(self, name):
-        try:
-            return self.frequencies[name]
-        except KeyError:
-            raise ValueError(f'No frequencies named {name}')
+@dataclass(frozen=True, slots=True)
+class Sleep:
+    seconds: float
+
+
+@dataclass(frozen=True, slots=True)
+class Sync:
+    target: float
+
+
+class Compiler:
+    bpm = 120
+    signature = (4, 4)
+
+    def __init__(self):
+        self.names = []
+        self.frequencies = {}
+        self.notes = {}
+        self.definitions = {}
+        self.rewind()
+
+    def rewind(self):
+        # Score time in seconds, and how far into the current bar it is in whole notes
+        self.position = 0.0
+        self.phase = Fraction(0)
+
+    def _slot(self, name):
+        self.names.append(name)
+        return len(self.names) - 1
 
     def get_note(self, name):
         try:
@@ -178,114 +183,382 @@ class FrmPlayer:
             return self.frequencies[name]
         raise ValueError(f'No notes or frequencies named {name}')
 
-    def stop(self):
-        log.info('Stopping..')
-        for note in self.notes.values():
-            self._stop(note)
-
-    def process(self, data):
-        self.running = True
-        tl = TreeList(self.parser.parse(data))
-        for block in tl:
-            match block:
-                case ('line', line):
-                    if not self.running:
-                        return
-                    self._run_line(line[0])
-                case ('multiline', lines):
-                    for line in lines:
-                        if not self.running:
-                            return
-                        self._run_line(line)
-                case _:
-                    log.info(f'Not a line: {block}')
-
-    def _run_line(self, line):
-        if line[0] != 'cmd':
-            return
-        return self._run_cmd(line[1])
-
-    def _run_cmd(self, cmd):
-        op = cmd[0]
-        match op:
-            case ('bpm', bpm):
-                self._set_bpm(int(bpm))
-            case ('signature', args):
-                fr = args['fraction']
-                self._set_signature(int(fr['numerator']), int(fr['denominator']))
-            case ('program', args):
-                print(args)
-                if isinstance(args, TreeList):
-                    prog, *names = args
-                    for name in names:
-                        self._set_note_program(int(prog), name)
-                else:
-                    prog = args
-                    self._set_program(int(prog))
-            case ('frequency', args):
-                self._new_frequency(args[0], float(args[1]))
-            case ('note', args):
-                r = args["ratio"]
-                if "harmonic" in r:
-                    self._new_note(
-                        name=args[0],
-                        parent_name=r["parent"] if "parent" in r else None,
-                        octave=int(r["octave"]) if "octave" in r else None,
-                        harmonics=list(map(int, one_or_many(r["harmonic"])))
-                    )
-                else:
-                    self._new_note(
-                        name=args[0],
-                        parent_name=r["parent"],
-                        octave=0,
-                        harmonics=(1, )
-                    )
-            case ('note_on', name):
-                self._note_on(name)
-            case ('note_off', name):
-                self._note_off(name)
-            case ('sleep', args):
-                fr = args['fraction']
-                self._sleep(int(fr['numerator']), int(fr['denominator']))
-            case ('sync', args):
-                self._sync()
+    def compile(self, tree):
+        for block in tree.children:
+            for cmd in block.children:
+                event = self._compile_cmd(cmd.children[0])
+                if event is not None:
+                    yield from event
+
+    def _compile_cmd(self, cmd):
+        args = cmd.children
+        match cmd.data:
+            case 'bpm':
+                self.set_bpm(int(args[0]))
+            case 'signature':
+                n, d = args[0].children
+                self.set_signature(int(n.children[0]), int(d.children[0]))
+            case 'program':
+                prog, *names = args
+                if names:
+                    return [self.note_program(int(prog), name) for name in names]
+                return [self.program(int(prog))]
+            case 'frequency':
+                return [self.frequency(args[0], float(args[1]))]
+            case 'note':
+                return [self.note(args[0], **self._ratio(args[1]))]
+            case 'note_on':
+                return [self.note_on(args[0])]
+            case 'note_off':
+                return [self.note_off(args[0])]
+            case 'sleep':
+                n, d = args[0].children
+                return [self.sleep(int(n.children[0]), int(d.children[0]))]
+            case 'sync':
+                return [self.sync()]
             case _: log.info('Unknown command: %s', cmd)
 
-    def _set_bpm(self, bpm):
+    def _ratio(self, ratio):
+        parent_name, octave, harmonics = None, None, []
+        for c in ratio.children:
+            match c.data:
+                case 'parent': parent_name = c.children[0]
+                case 'octave': octave = int(c.children[0])
+                case 'harmonic': harmonics.append(int(c.children[0]))
+        if not harmonics:
+            return dict(parent_name=parent_name, octave=0, harmonics=(1, ))
+        return dict(parent_name=parent_name, octave=octave, harmonics=harmonics)
+
+    def set_bpm(self, bpm):
         log.info('Setting BPM: %s', bpm)
         self.bpm = bpm
 
-    def _set_signature(self, n, d):
+    def set_signature(self, n, d):
         log.info('Setting signature: %s/%s', n, d)
         self.signature = (n, d)
+        self.phase %= self.bar()
+
+    def bar(self):
+        return Fraction(*self.signature)
+
+    def seconds(self, length):
+        return float(length * self.signature[1] * 60 / self.bpm)
+
+    def program(self, p):
+        return SetProgram(p)
+
+    def note_program(self, p, name):
+        return SetNoteProgram(self.get_note(name), p)
+
+    def frequency(self, name, freq):
+        slot = self.frequencies.get(name)
+        if slot is None:
+            slot = self.frequencies[name] = self._slot(name)
+        return NewFrequency(slot, freq)
+
+    def note(self, name, parent_name, octave, harmonics):
+        if name in self.notes:
+            slot = self.notes[name]
+            parent, old_octave, old_harmonics = self.definitions[slot]
+            if parent_name is not None:
+                parent = self.get_note_or_freq(parent_name)
+            ancestor = parent
+            while ancestor in self.definitions:
+                if ancestor == slot:
+                    raise ValueError(f'Note {name} can\'t depend on itself')
+                ancestor = self.definitions[ancestor][0]
+            if octave is None:
+                octave = old_octave
+            if harmonics is None:
+                harmonics = old_harmonics
+        else:
+            if parent_name is None:
+                raise ValueError(f'Can\'t initialize note {name} without a parent')
+            parent = self.get_note_or_freq(parent_name)
+            slot = self.notes[name] = self._slot(name)
+        self.definitions[slot] = (parent, octave, harmonics)
+        return NewNote(slot, parent, harmonic_ratio(octave, harmonics))
+
+    def note_on(self, name):
+        return NoteOn(self.get_note(name))
+
+    def note_off(self, name):
+        return NoteOff(self.get_note(name))
+
+    def sleep(self, n, d):
+        seconds = n * 60 / (self.bpm * d / self.signature[1])
+        self.position += seconds
+        self.phase = (self.phase + Fraction(n, d)) % self.bar()
+        return Sleep(seconds)
+
+    def sync(self):
+        # The rest of the bar is counted at the current tempo, so bpm changes mid-bar move the bar line
+        if self.phase:
+            self.position += self.seconds(self.bar() - self.phase)
+            self.phase = Fraction(0)
+        return Sync(self.position)
+
+
+def log_report(channels, tracer=None):
+    log.info('Channels: %s', channels.stats())
+    if tracer is not None:
+        for line in tracer.format_trace():
+            log.info(line)
+        for line in tracer.format_report():
+            log.info(line)
+
+
+CHANNELS_NUM = 16
 
-    def _set_program(self, p):
-        log.info('Setting program: %s', p)
-        self.program = p
 
-    def _set_note_program(self, p, name):
-        log.info('Setting program of %s: %s ', name, p)
-        note = self.get_note(name)
-        note.program = p
+class ChannelRegistry:
+    policy = 'oldest'
+
+    def __init__(self, max_channels=None, policy=None, priorities=None):
+        size = max_channels or CHANNELS_NUM
+        if policy is not None:
+            self.policy = policy
+        if self.policy not in STEAL:
+            raise ValueError(f'Unknown stealing policy: {self.policy}')
+        self.priorities = priorities or {}
+        self.free_channels = list(range(size - 1, -1, -1))
+        self.active = OrderedDict()
+        self.programs = {}
+        self.bends = {}
+        self.steals = 0
+        self.peak = 0
+
+    def allocate(self, owner=None, velocity=0, program=None, on_steal=None):
+        released = None
+        if self.free_channels:
+            i = self.free_channels.pop()
+        else:
+            i, released = self._steal()
+        self.active[i] = (owner, velocity, program, on_steal)
+        self.peak = max(self.peak, len(self.active))
+        return i, released
+
+    def _steal(self):
+        match self.policy:
+            case 'oldest':
+                i = next(iter(self.active))
+            case 'quietest':
+                i = min(self.active, key=lambda c: self.active[c][1])
+            case 'priority':
+                i = min(self.active, key=lambda c: self.priorities.get(self.active[c][2], 0))
+        owner, _, _, on_steal = self.active.pop(i)
+        self.steals += 1
+        log.info('Stealing channel %s', i)
+        # The victim may belong to another player; the thief silences it in its own batch
+        released = on_steal(owner, i) if on_steal is not None else None
+        return i, released
+
+    def free(self, i):
+        if self.active.pop(i, None) is not None:
+            self.free_channels.append(i)
 
-    def _new_frequency(self, name, freq):
-        log.info('Setting frequency: %s=%s', name, freq)
-        self.frequencies[name] = Frequency(freq)
+    def stats(self):
+        return {'active': len(self.active), 'peak': self.peak, 'steals': self.steals}
+
+
+class FrmPlayer:
+    program = 85
+
+    port = None
+    channels = None
+
+    running = False
+    retune = False
+
+    def __init__(self, parser, clock=None, port=None, retune=None, channels=None, steal=None, priorities=None, tracer=None):
+        log.info('Initializing player')
+        self.parser = parser
+        self.compiler = Compiler()
+        self.nodes = []
+        self.clock = clock or Clock()
+        self.tracer = tracer
+        if retune is not None:
+            self.retune = retune
+        log.info('Opening port')
+        self.port = port or get_port()
+        self.channels = channels or ChannelRegistry(policy=steal, priorities=priorities)
+        self.pending = []
+        self._handlers = {
+            SetProgram: self._set_program,
+            SetNoteProgram: self._set_note_program,
+            NewFrequency: self._new_frequency,
+            NewNote: self._new_note,
+            NoteOn: self._note_on,
+            NoteOff: self._note_off,
+            Sleep: self._sleep,
+            Sync: self._sync,
+        }
+        self._timing_keys = {k: f'dispatch.{k.__name__}' for k in self._handlers}
+
+    def _send(self, cmd, *args, **kwargs):
+        self.pending.append(mido.Message(cmd, *args, **kwargs))
+
+    def _program_change(self, channel, program):
+        if self.channels.programs.get(channel) == program:
+            return
+        self.channels.programs[channel] = program
+        self._send('program_change', channel=channel, program=program)
+
+    def _pitchwheel(self, channel, pitch):
+        if self.channels.bends.get(channel) == pitch:
+            return
+        self.channels.bends[channel] = pitch
+        self._send('pitchwheel', channel=channel, pitch=pitch)
+
+    def flush(self):
+        if not self.pending:
+            return
+        tracer = self.tracer
+        if tracer is not None:
+            t = perf_counter()
+        send = self.port.send
+        for msg in self.pending:
+            send(msg)
+        if tracer is not None:
+            tracer.time('send', perf_counter() - t)
+            tracer.trace(*self.pending)
+        self.pending.clear()
+
+    def stop(self, report=True):
+        log.info('Stopping..')
+        for node in self.nodes:
+            if isinstance(node, Note):
+                self._stop(node)
+        self.flush()
+        log.info('Lateness: %s', self.clock.report())
+        if report:
+            log_report(self.channels, self.tracer)
+
+    def compile(self, data):
+        if self.tracer is None:
+            return self.compiler.compile(self.parser.parse(data))
+        t = perf_counter()
+        tree = self.parser.parse(data)
+        self.tracer.time('parse', perf_counter() - t)
+        return self.tracer.timed('compile', self.compiler.compile(tree))
+
+    def compile_lines(self, lines):
+        for i, line in enumerate(lines, 1):
+            try:
+                events = self.compile(line)
+            except UnexpectedInput:
+                log.error(f'Failed to parse line {i}: {line!r}')
+                raise
+            yield from events
+
+    def process(self, data):
+        # Every call starts a fresh clock, so the score timeline starts over too
+        self.compiler.rewind()
+        self.play(self.compile(data))
+
+    def play(self, events, origin=None):
+        self.running = True
+        self.clock.start(origin)
+        tracer = self.tracer
+        wait = self.clock.wait_until
+        try:
+            for target in self._steps(events):
+                late = wait(target)
+                if tracer is not None:
+                    tracer.time('lateness', late)
+        finally:
+            self.flush()
+
+    async def play_async(self, events, origin=None):
+        self.running = True
+        self.clock.start(origin)
+        tracer = self.tracer
+        wait = self.clock.wait_until_async
+        try:
+            for target in self._steps(events):
+                late = await wait(target)
+                if tracer is not None:
+                    tracer.time('lateness', late)
+        finally:
+            self.flush()
+
+    def _steps(self, events):
+        if self.tracer is not None:
+            return self._steps_traced(events)
+        return self._steps_plain(events)
+
+    def _steps_plain(self, events):
+        handlers = self._handlers
+        for event in events:
+            if not self.running:
+                return
+            target = handlers[type(event)](event)
+            if target is not None:
+                yield target
+
+    def _steps_traced(self, events):
+        handlers = self._handlers
+        keys = self._timing_keys
+        tracer = self.tracer
+        for event in events:
+            if not self.running:
+                return
+            kind = type(event)
+            tracer.trace(event)
+            t = perf_counter()
+            target = handlers[kind](event)
+            tracer.time(keys[kind], perf_counter() - t)
+            if target is not None:
+                yield target
+
+    def _set_program(self, event):
+        self.program = event.program
+
+    def _set_note_program(self, event):
+        self.nodes[event.slot].program = event.program
+
+    def _new_frequency(self, event):
+        if event.slot < len(self.nodes):
+            self._retune(self.nodes[event.slot].set_frequency(event.frequency))
+        else:
+            self.nodes.append(Frequency(event.frequency))
 
     def _play(self, note):
+        v = 100
         if note.sound is not None:
             c = note.sound.channel
             self._send('note_off', channel=c, note=note.sound.note)
         else:
-            c = self.channels.allocate()
             prog = note.program or self.program
-            self._send('program_change', channel=c, program=prog)
+            c, released = self.channels.allocate(note, v, prog, self._stolen)
+            if released is not None:
+                self._send('note_off', channel=c, note=released)
+            self._program_change(c, prog)
         n, b = freq_to_midi(note.freq())
-        v = 100
         note.sound = Sound(c, n, v)
-        self._send('pitchwheel', channel=c, pitch=b)
+        self._pitchwheel(c, b)
         self._send('note_on', channel=c, note=n, velocity=v)
 
+    def _stolen(self, note, channel):
+        released = note.sound.note
+        note.sound = None
+        return released
+
+    def _retune(self, notes):
+        if not self.retune:
+            return
+        for note in notes:
+            if note.sound is None:
+                continue
+            c = note.sound.channel
+            n, b = freq_to_midi(note.freq())
+            if n != note.sound.note:
+                self._send('note_off', channel=c, note=note.sound.note)
+            self._pitchwheel(c, b)
+            if n != note.sound.note:
+                self._send('note_on', channel=c, note=n, velocity=note.sound.velocity)
+                note.sound.note = n
+
     def _stop(self, note):
         if note.sound is None:
             return
@@ -297,72 +570,81 @@ class FrmPlayer:
         self.channels.free(note.sound.channel)
         note.sound = None
 
-    def _new_note(self, name, parent_name, octave, harmonics):
-        log.info('New note: %s=%s:%s@%s', name, parent_name, octave, harmonics)
-        if name in self.notes:
-            note = self.get_note(name)
-            if parent_name is not None:
-                note.parent = self.get_note_or_freq(parent_name)
-            if octave is not None:
-                note.octave = octave
-            if harmonics is not None:
-                note.harmonics = harmonics
+    def _new_note(self, event):
+        parent = self.nodes[event.parent]
+        if event.slot < len(self.nodes):
+            note = self.nodes[event.slot]
+            dependents = note.set_parent(parent, event.ratio)
             if note.sound:
                 self._play(note)
+            self._retune(dependents)
         else:
-            if parent_name is None:
-                raise ValueError(f'Can\'t initialize note {name} without a parent')
-            if parent_name in self.notes:
-                parent = self.get_note_or_freq(parent_name)
-            elif parent_name in self.frequencies:
-                parent = self.get_frequency(parent_name)
-            else:
-                raise ValueError(f'No note or frequency with name {parent_name}')
-            self.notes[name] = Note(
-                parent,
-                octave,
-                harmonics,
-                None,
-                None,
-            )
-
-    def _note_on(self, name):
-        log.info('Note on: %s', name)
-        self._play(self.get_note(name))
-
-    def _note_off(self, name):
-        log.info('Note off: %s', name)
-        self._stop(self.get_note(name))
-
-    def _sleep(self, n, d):
-        log.info('Sleep: %s/%s', n, d)
-        sleep(n * 60 / (self.bpm * d / self.signature[1]))
-
-    def _sync(self):
-        log.info('Syncing.')
-        
-
-
-def run_file(filename):
+            self.nodes.append(Note(parent, event.ratio))
+
+    def _note_on(self, event):
+        self._play(self.nodes[event.slot])
+
+    def _note_off(self, event):
+        self._stop(self.nodes[event.slot])
+
+    def _sleep(self, event):
+        self.flush()
+        return self.clock.advance(event.seconds)
+
+    def _sync(self, event):
+        self.flush()
+        return self.clock.sync(event.target)
+
+    def new_frequency(self, name, freq):
+        self.play([self.compiler.frequency(name, freq)])
+
+    def new_note(self, name, parent_name, octave, harmonics):
+        self.play([self.compiler.note(name, parent_name, octave, harmonics)])
+
+    def note_on(self, name):
+        self.play([self.compiler.note_on(name)])
+
+    def note_off(self, name):
+        self.play([self.compiler.note_off(name)])
+
+
+def load(player, filename, stream=False):
+    if stream:
+        return player.compile_lines(iter_lines(filename))
+    return list(player.compile(get_file(filename)))
+
+
+def run_file(filename, stream=False, **options):
     try:
         log.info(f'Running: {filename}')
         parser = get_parser()
-        player = FrmPlayer(parser)
-        file = get_file(filename)
-        player.process(file)
+        player = FrmPlayer(parser, **options)
+        player.play(load(player, filename, stream))
     finally:
         player.stop()
 
 
-def run_cli():
+def export_file(filename, output=None, stream=False, **options):
+    output = output or os.path.splitext(filename)[0] + '.mid'
+    log.info(f'Exporting: {filename} -> {output}')
+    clock = VirtualClock()
+    port = MidiFilePort(clock)
+    player = FrmPlayer(get_parser(), clock=clock, port=port, **options)
+    player.play(load(player, filename, stream))
+    player.stop()
+    port.save(output)
+    return output
+
+
+def run_cli(**options):
     log.info('Running CLI')
     parser = get_parser()
-    player = FrmPlayer(parser)
+    player = FrmPlayer(parser, **options)
     while True:
         try:
             inp = input(':> ')
             player.process(inp+"\n")
-        except UnexpectedCharacters:
+        except UnexpectedInput:
             log.info(f'Failed to parse: {inp}')
             pass
         except EOFError:
@@ -378,9 +660,25 @@ def run_cli():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser('Play FRM files')
     parser.add_argument("filename", metavar='filename', nargs="*", help='Filename to play')
+    add_player(parser)
+    add_port(parser)
+    parser.add_argument("-v", "--verbose", action='store_true', help='Enable debug logging')
+    parser.add_argument("--export", action='store_true', help='Write each file to a .mid next to it instead of playing')
     args = parser.parse_args()
-    if args.filename:
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    options = player_options(args)
+    if args.export:
         for filename in args.filename:
-            run_file(filename)
-    else:
-        run_cli()
+            export_file(filename, stream=args.stream, **options)
+        raise SystemExit
+    port = options['port'] = open_port(args.port)
+    try:
+        if args.filename:
+            for filename in args.filename:
+                run_file(filename, stream=args.stream, **options)
+        else:
+            run_cli(**options)
+    finally:
+        port.close()
+        if hasattr(port, 'stats'):
+            log.info('Port: %s', port.stats())
@@ -3,7 +3,7 @@ from time import time
 
 import pygame
 
-from play_frm import Frequency, Note, FrmPlayer
+from .play_frm import Frequency, Note, FrmPlayer
 
 
 class Voice:
@@ -74,25 +74,25 @@ class Player:
     }
     def __init__(self):
         self.frm = FrmPlayer(None)
-        self.frm._new_frequency('f', 220)
-        self.frm._new_note('voice', 'f', 0, [1])
+        self.frm.new_frequency('f', 220)
+        self.frm.new_note('voice', 'f', 0, [1])
         for i in range(0, 10):
-            self.frm._new_note(f'd{i}', 'f', 0, [1])
+            self.frm.new_note(f'd{i}', 'f', 0, [1])
         self.state['voice'] = Voice('f')
 
     def stop(self):
         self.frm.stop()
 
     def _update_voice(self, voice_name, voice):
-        self.frm._note_off(voice_name)
+        self.frm.note_off(voice_name)
         if voice.is_on():
-            self.frm._new_note(
+            self.frm.new_note(
                 voice_name,
                 voice.base,
                 voice.octave,
                 voice.harmonics
             )
-            self.frm._note_on(voice_name)
+            self.frm.note_on(voice_name)
 
     def harmonic_on(self, harmonic):
         self.state['voice'].add_harmonic(harmonic)
@@ -138,7 +138,7 @@ class Player:
                         player.state['drones'][drone].voice
                     )
                 else:
-                    player.frm._note_off(player.state['drones'][drone].name)
+                    player.frm.note_off(player.state['drones'][drone].name)
         return clb
 
 
@@ -0,0 +1,118 @@
+from array import array
+from time import perf_counter
+
+import mido
+
+
+TICKS_PER_BEAT = 480
+TEMPO = 500000
+
+
+def get_port(name=None):
+    if name is None:
+        names = [o for o in mido.get_output_names() if o.startswith('FLUID')]
+        if not names:
+            raise ValueError('No FluidSynth output found; start fluidsynth or pick another port')
+        name = names[0]
+    return mido.open_output(name)
+
+
+def open_port(spec=None, clock=None):
+    match spec:
+        case None | 'fluid':
+            return get_port()
+        case 'null':
+            return NullPort()
+        case 'record':
+            return RecordingPort(clock)
+        case str() if spec.startswith('file:'):
+            return MidiFilePort(clock, filename=spec[len('file:'):])
+        case _:
+            return get_port(spec)
+
+
+class Timestamps:
+
+    def __init__(self, clock=None):
+        self.clock = clock
+        self.start = perf_counter()
+
+    def now(self):
+        if self.clock is None:
+            return perf_counter() - self.start
+        return self.clock.now()
+
+
+class MidiFilePort(Timestamps):
+
+    def __init__(self, clock=None, ticks_per_beat=TICKS_PER_BEAT, tempo=TEMPO, filename=None):
+        super().__init__(clock)
+        self.ticks_per_beat = ticks_per_beat
+        self.tempo = tempo
+        self.filename = filename
+        self.messages = []
+
+    def send(self, msg):
+        self.messages.append((self.now(), msg))
+
+    def to_midi_file(self):
+        mid = mido.MidiFile(ticks_per_beat=self.ticks_per_beat)
+        track = mido.MidiTrack()
+        track.append(mido.MetaMessage('set_tempo', tempo=self.tempo, time=0))
+        last = 0
+        for t, msg in self.messages:
+            tick = round(mido.second2tick(t, self.ticks_per_beat, self.tempo))
+            track.append(msg.copy(time=tick - last))
+            last = tick
+        mid.tracks.append(track)
+        return mid
+
+    def save(self, filename):
+        self.to_midi_file().save(filename)
+
+    def close(self):
+        if self.filename is not None:
+            self.save(self.filename)
+
+
+class RecordingPort(Timestamps):
+
+    def __init__(self, clock=None):
+        super().__init__(clock)
+        self.times = array('d')
+        self.sizes = array('B')
+        self.data = array('B')
+
+    def send(self, msg):
+        self.times.append(self.now())
+        data = msg.bytes()
+        self.sizes.append(len(data))
+        self.data.extend(data)
+
+    def messages(self):
+        offset = 0
+        for t, size in zip(self.times, self.sizes):
+            yield t, mido.Message.from_bytes(self.data[offset:offset + size])
+            offset += size
+
+    def stats(self):
+        if not self.times:
+            return {'messages': 0}
+        return {
+            'messages': len(self.times),
+            'bytes': len(self.data),
+            'span': self.times[-1] - self.times[0],
+        }
+
+    def close(self):
+        pass
+
+
+class NullPort:
+    count = 0
+
+    def send(self, msg):
+        self.count += 1
+
+    def close(self):
+        pass
@@ -0,0 +1,148 @@
+import argparse
+import json
+import logging
+import os
+import struct
+
+import numpy as np
+
+
+log = logging.getLogger('results')
+
+MAGIC = b'CHORDRES'
+VERSION = 1
+ALIGN = 16
+SUFFIX = '.bres'
+TIMING = ('presented', 'responded')
+CHUNK = 100000
+# The first compare tester wrote the Choice member itself rather than its value
+ANSWERS = {'Choice.left': -1, 'Choice.equal': 0, 'Choice.right': 1}
+
+SCHEMAS = {
+    'compare': np.dtype([
+        ('instrument', '<u1'),
+        ('n_1', '<i4'), ('d_1', '<i4'), ('freq_1', '<f8'),
+        ('n_2', '<i4'), ('d_2', '<i4'), ('freq_2', '<f8'),
+        ('answer', '<i1'),
+        ('presented', '<f8'), ('responded', '<f8'),
+    ]),
+    'min': np.dtype([
+        ('instrument', '<u1'),
+        ('n', '<i4'), ('d', '<i4'), ('freq_1', '<f8'), ('freq_2', '<f8'),
+        ('answer', '<i1'),
+        ('presented', '<f8'), ('responded', '<f8'),
+    ]),
+    'max': np.dtype([
+        ('instrument', '<u1'),
+        ('n', '<i4'), ('d', '<i4'), ('freq_1', '<f8'), ('freq_2', '<f8'),
+        ('answer', '<i1'),
+        ('presented', '<f8'), ('responded', '<f8'),
+    ]),
+}
+
+KINDS = {
+    '1': 'compare',
+    'min_interval': 'min',
+    'max_interval': 'max',
+}
+
+
+def is_binary(filename):
+    return filename.endswith(SUFFIX)
+
+
+def kind_of(filename):
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    if stem not in KINDS:
+        raise ValueError(f'Can\'t tell the experiment of {filename}; pass one of {", ".join(SCHEMAS)}')
+    return KINDS[stem]
+
+
+def encode_header(kind, dtype):
+    meta = json.dumps({
+        'version': VERSION,
+        'kind': kind,
+        'fields': [(name, dtype.fields[name][0].str) for name in dtype.names],
+    }).encode()
+    size = len(MAGIC) + 4 + len(meta)
+    meta += b' ' * (-size % ALIGN)
+    return MAGIC + struct.pack('<I', len(meta)) + meta
+
+
+def read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f'{f.name} is not a results file')
+    size, = struct.unpack('<I', f.read(4))
+    meta = json.loads(f.read(size))
+    if meta['version'] > VERSION:
+        raise ValueError(f'{f.name} has results format version {meta["version"]}')
+    return meta['kind'], np.dtype([tuple(field) for field in meta['fields']]), f.tell()
+
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        kind, dtype, offset = read_header(f)
+    count = (os.path.getsize(filename) - offset) // dtype.itemsize
+    if not count:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+
+def append(filename, kind, records):
+    dtype = SCHEMAS[kind]
+    records = np.asarray(records, dtype=dtype)
+    new = not os.path.exists(filename) or not os.path.getsize(filename)
+    if not new:
+        with open(filename, 'rb') as f:
+            stored, stored_dtype, _ = read_header(f)
+        if stored != kind or stored_dtype != dtype:
+            raise ValueError(f'{filename} holds {stored} results, not {kind}')
+    with open(filename, 'ab') as f:
+        if new:
+            f.write(encode_header(kind, dtype))
+        f.write(records.tobytes())
+
+
+def output(filename, kind):
+    while True:
+        inp = yield
+        if inp is None:
+            break
+        append(filename, kind, [tuple(inp)])
+
+
+def convert(filename, output=None, kind=None, chunk=CHUNK):
+    import pandas as pd
+
+    kind = kind or kind_of(filename)
+    output = output or os.path.splitext(filename)[0] + SUFFIX
+    dtype = SCHEMAS[kind]
+    log.info(f'Converting {kind}: {filename} -> {output}')
+    tmp = output + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    count = 0
+    columns = [name for name in dtype.names if name not in TIMING]
+    for data in pd.read_csv(filename, header=None, names=columns, index_col=False, chunksize=chunk):
+        records = np.empty(len(data), dtype=dtype)
+        for name in TIMING:
+            records[name] = np.nan
+        data['answer'] = pd.to_numeric(data['answer'].map(lambda v: ANSWERS.get(v, v)))
+        for name in columns:
+            records[name] = data[name].to_numpy()
+        append(tmp, kind, records)
+        count += len(records)
+    if not count:
+        append(tmp, kind, np.zeros(0, dtype=dtype))
+    os.replace(tmp, output)
+    return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Convert .res result files to the binary results format')
+    parser.add_argument("filename", metavar='filename', nargs="+", help='Result files to convert')
+    parser.add_argument("--kind", choices=tuple(SCHEMAS), help='Experiment type (default: guessed from the file name)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for filename in args.filename:
+        convert(filename, kind=args.kind)
@@ -0,0 +1,193 @@
+import argparse
+from dataclasses import dataclass
+import logging
+import math
+import os
+import wave
+
+import numpy as np
+
+from .clock import VirtualClock
+from .options import add_player, player_options
+from .play_frm import FrmPlayer, Sound, get_parser, load
+from .ports import NullPort
+
+
+log = logging.getLogger('synth')
+
+
+RATE = 44100
+BLOCK = 2048
+ATTACK = 0.005
+RELEASE = 0.05
+GAIN = 0.2
+HARMONICS = 16
+
+TIMBRES = {
+    'sine': [1.0],
+    'soft': [1.0, 0.5, 0.25, 0.125, 0.0625],
+    'flute': [1.0, 0.2, 0.05],
+    'voice': [1.0, 0.6, 0.3, 0.25, 0.1, 0.05],
+    'square': [1.0 / k if k % 2 else 0.0 for k in range(1, HARMONICS + 1)],
+    'saw': [1.0 / k for k in range(1, HARMONICS + 1)],
+}
+
+PROGRAMS = {
+    80: 'square',
+    81: 'saw',
+    82: 'flute',
+    85: 'voice',
+    87: 'saw',
+}
+
+
+def timbre(program):
+    weights = np.zeros(HARMONICS)
+    t = TIMBRES[PROGRAMS.get(program, 'soft')]
+    weights[:len(t)] = t
+    return weights / np.abs(weights).sum()
+
+
+@dataclass(eq=False)
+class Voice:
+    freq: float
+    weights: np.ndarray
+    phase: float = 0.0
+    gain: float = 0.0
+    target: float = 1.0
+
+
+class Synth:
+
+    def __init__(self, rate=RATE, gain=GAIN, attack=ATTACK, release=RELEASE):
+        self.rate = rate
+        self.gain = gain
+        self.attack = attack
+        self.release = release
+        self.voices = {}
+        self.k = np.arange(1, HARMONICS + 1, dtype=float)
+
+    def note_on(self, key, freq, program):
+        voice = self.voices.get(key)
+        if voice is None:
+            self.voices[key] = Voice(freq, timbre(program))
+        else:
+            voice.freq = freq
+            voice.target = 1.0
+
+    def note_off(self, key):
+        voice = self.voices.get(key)
+        if voice is not None:
+            voice.target = 0.0
+
+    def set_freq(self, key, freq):
+        voice = self.voices.get(key)
+        if voice is not None:
+            voice.freq = freq
+
+    def render(self, n):
+        voices = list(self.voices.values())
+        if not voices:
+            return np.zeros(n)
+        freq = np.array([v.freq for v in voices])
+        phase = np.array([v.phase for v in voices])
+        gain = np.array([v.gain for v in voices])
+        target = np.array([v.target for v in voices])
+        weights = np.stack([v.weights for v in voices])
+        weights = np.where(self.k * freq[:, None] < self.rate / 2, weights, 0.0)
+
+        i = np.arange(n)
+        step = 2 * math.pi * freq / self.rate
+        phi = phase[:, None] + step[:, None] * i
+        # sin((k+1)x) = 2cos(x)sin(kx) - sin((k-1)x) builds the partials without more sin() calls
+        sin_k = np.sin(phi)
+        sin_prev = np.zeros_like(sin_k)
+        cos_2 = 2 * np.cos(phi)
+        signal = weights[:, :1] * sin_k
+        # Partials above Nyquist are zeroed, so a high enough note leaves none and renders silence
+        audible = np.flatnonzero(weights.any(axis=0))
+        for k in range(1, audible.max() + 1 if audible.size else 1):
+            sin_prev, sin_k = sin_k, cos_2 * sin_k - sin_prev
+            signal += weights[:, k:k + 1] * sin_k
+        slope = np.where(target > 0, 1 / (self.attack * self.rate), -1 / (self.release * self.rate))
+        env = np.clip(gain[:, None] + slope[:, None] * (i + 1), 0.0, 1.0)
+        out = (env * signal).sum(axis=0) * self.gain
+
+        phase = (phase + step * n) % (2 * math.pi)
+        for v, p, g in zip(voices, phase, env[:, -1]):
+            v.phase = p
+            v.gain = g
+        for key, v in list(self.voices.items()):
+            if v.target == 0.0 and v.gain == 0.0:
+                del self.voices[key]
+        return out
+
+
+def to_pcm(samples):
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+
+class SynthPlayer(FrmPlayer):
+
+    def __init__(self, parser, rate=RATE, **options):
+        super().__init__(parser, clock=VirtualClock(), port=NullPort(), **options)
+        self.synth = Synth(rate)
+
+    def _play(self, note):
+        self.synth.note_on(note, note.freq(), note.program or self.program)
+        note.sound = Sound(None, 0, 100)
+
+    def _stop(self, note):
+        if note.sound is None:
+            return
+        self.synth.note_off(note)
+        note.sound = None
+
+    def _retune(self, notes):
+        if not self.retune:
+            return
+        for note in notes:
+            if note.sound is not None:
+                self.synth.set_freq(note, note.freq())
+
+    def _write(self, out, n):
+        while n > 0:
+            block = min(n, BLOCK)
+            out.writeframes(to_pcm(self.synth.render(block)))
+            n -= block
+
+    def render(self, events, out):
+        rate = self.synth.rate
+        self.running = True
+        self.clock.start()
+        position = 0
+        for target in self._steps(events):
+            end = round(target * rate)
+            self._write(out, end - position)
+            position = end
+        self.stop()
+        self._write(out, math.ceil(self.synth.release * rate) + 1)
+
+
+def render_file(filename, output=None, stream=False, rate=RATE, **options):
+    output = output or os.path.splitext(filename)[0] + '.wav'
+    log.info(f'Rendering: {filename} -> {output}')
+    player = SynthPlayer(get_parser(), rate=rate, **options)
+    events = load(player, filename, stream)
+    with wave.open(output, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        player.render(events, out)
+    return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Render FRM files to WAV')
+    parser.add_argument("filename", metavar='filename', nargs="+", help='Filenames to render')
+    parser.add_argument("--rate", type=int, default=RATE, help='Sample rate')
+    add_player(parser, steal=False, timing=False)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for filename in args.filename:
+        render_file(filename, stream=args.stream, rate=args.rate, **player_options(args))
@@ -1,9 +1,19 @@
-import csv
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from gen import gen_interval, scale
+from . import results
+from .gen_chr import scale
 from random import shuffle, randint
-import math
 from functools import partial
+from time import perf_counter
+
+import mido
+
+from .adaptive import PRECISION, Quest, cents
+from .clock import Clock
+from .play_chr import ChrPlayer
+from .options import add_port
+from .ports import NullPort, get_port, open_port
 
 
 class Choice(Enum):
@@ -28,92 +38,196 @@ def read_custom_input(mapping, prompt):
     return mapping.get(input(prompt))
 
 
-def midi_g(program):
-    print("a a0 0 200")
-    print("a a1 1 a0:3/2")
-    print(f"program {program} a0 a1")
-    while True:
-        inp = yield
-        if inp is None:
-            break
-        freq, n, den = inp
-        print("as")
-        print(f"c a0 {freq}")
-        print(f"c a1 a0:{n}/{den}")
-        print("ap")
-    print("as")
-
-
-def midi_g_sep(program):
-    print("a a0 0 200")
-    print("a a1 1 a0:3/2")
-    print(f"program {program} a0 a1")
-    while True:
-        inp = yield
-        if inp is None:
-            break
-        freq, n, den = inp
-        print("as")
-        print(f"c a0 {freq}")
-        print(f"c a1 a0:{n}/{den}")
-        print("as")
-        print("p a0")
-        print("sleep 2")
-        print("as")
-        print("p a1")
-        print("sleep 2")
-        print("as")
-    print("as")
-
-
-def output(filename):
-    with open(filename, 'a+') as f:
-        writer = csv.writer(f)
-        while True:
-            inp = yield
-            if inp is None:
-                break
-            writer.writerow(inp)
-
-
-def run_compare_intervals(instrument=82, freq=220, nums=(2, 3, 4, 5), scales=3):
+def setup_lines(program):
+    return ["a a0 0 200", "a a1 1 a0:3/2", f"program {program} a0 a1"]
+
+
+def together_lines(freq, n, den):
+    return ["as", f"c a0 {freq}", f"c a1 a0:{n}/{den}", "ap"]
+
+
+def separate_lines(freq, n, den):
+    return [
+        "as", f"c a0 {freq}", f"c a1 a0:{n}/{den}",
+        "as", "p a0", "sleep 2",
+        "as", "p a1", "sleep 2",
+        "as",
+    ]
+
+
+class Stimulus:
+    # Trials are compiled to MIDI messages ahead of time and sent on an absolute clock
+
+    def __init__(self, program, port=None, clock=None):
+        self.port = port or get_port()
+        self.clock = clock or Clock()
+        self.player = ChrPlayer(port=NullPort(), verbose=False)
+        self.sounding = set()
+        self.origin = perf_counter()
+        self.present(self.prepare(setup_lines(program)))
+
+    def now(self):
+        return perf_counter() - self.origin
+
+    def prepare(self, lines):
+        schedule = self.player.prepare(lines)
+        # Sounding notes are tracked by present(), so every trial is prepared from silence
+        self.player.all_stop()
+        return schedule
+
+    def silence(self):
+        for channel, note in self.sounding:
+            self.port.send(mido.Message('note_off', channel=channel, note=note))
+        self.sounding.clear()
+
+    def present(self, schedule):
+        self.silence()
+        self.clock.start()
+        onset = None
+        for t, messages in schedule:
+            self.clock.wait_until(t)
+            if onset is None:
+                onset = self.now()
+            for msg in messages:
+                self.port.send(msg)
+                if msg.type == 'note_on':
+                    self.sounding.add((msg.channel, msg.note))
+                elif msg.type == 'note_off':
+                    self.sounding.discard((msg.channel, msg.note))
+        return onset
+
+    def close(self):
+        self.silence()
+
+
+def prefetch(func, items):
+    # Prepare the next trial in the background while the current one is answered
+    with ThreadPoolExecutor(1) as pool:
+        pending = None
+        for item in items:
+            future = pool.submit(func, item)
+            if pending is not None:
+                yield pending[0], pending[1].result()
+            pending = (item, future)
+        if pending is not None:
+            yield pending[0], pending[1].result()
+
+
+def run_compare_intervals(instrument=82, freq=220, nums=(2, 3, 4, 5), scales=3, port=None):
     candidates_1 = scale(nums, scales)
     candidates_2 = scale(nums, scales)
     shuffle(candidates_1)
     shuffle(candidates_2)
-    g = midi_g(82)
-    next(g)
-    o = output('1.res')
+    trials = [
+        (c1, c2, randint(freq//2, freq*2), randint(freq//2, freq*2))
+        for c1, c2 in zip(candidates_1, candidates_2)
+    ]
+    stimulus = Stimulus(instrument, port)
+    o = results.output('1.bres', 'compare')
     next(o)
-    for c1, c2 in zip(candidates_1, candidates_2):
-        freq_1, freq_2 = randint(freq//2, freq*2), randint(freq//2, freq*2)
-        while True:
-            g.send((freq_1, *c1))
-            print('sleep 1')
-            g.send((freq_2, *c2))
-            inp = read_input()
-            print(f'# {inp}')
-            if inp is not None:
-                o.send([
-                    instrument,
-                    c1[0], c1[1], 1.0*c1[0]/c1[1]*freq,
-                    c2[0], c2[1], 1.0*c2[0]/c2[1]*freq,
-                    inp
-                ])
-                break
+    prepare = lambda trial: stimulus.prepare(
+        together_lines(trial[2], *trial[0]) + ['sleep 1'] + together_lines(trial[3], *trial[1])
+    )
+    try:
+        for (c1, c2, freq_1, freq_2), schedule in prefetch(prepare, trials):
+            while True:
+                presented = stimulus.present(schedule)
+                try:
+                    inp = read_input()
+                except (KeyboardInterrupt, EOFError):
+                    print('# exiting')
+                    return
+                responded = stimulus.now()
+                print(f'# {inp}')
+                if inp is not None:
+                    o.send([
+                        instrument,
+                        c1[0], c1[1], 1.0*c1[0]/c1[1]*freq_1,
+                        c2[0], c2[1], 1.0*c2[0]/c2[1]*freq_2,
+                        inp.value, presented, responded
+                    ])
+                    break
+    finally:
+        stimulus.close()
     print('# All done!')
 
 
+def min_trials(candidates, min_freq, max_freq, cutoff_min, cutoff_max):
+    for candidate in candidates:
+        freq = randint(min_freq, max_freq)
+        n, d = candidate
+        if randint(0, 1):
+            n, d = d, n
+        if not (cutoff_min <= n/d <= cutoff_max):
+            if not (cutoff_min <= d/n <= cutoff_max):
+                print(f'# Skipping {n}/{d} because false {cutoff_min} <= {n/d} <= {cutoff_max}')
+                continue
+            n, d = d, n
+        yield freq, n, d
+
+
+def adaptive_trials(quest, candidates, min_freq, max_freq, count, swap=False):
+    # Lazy, so each pick sees the answers recorded so far
+    for _ in range(count):
+        if quest.done():
+            break
+        n, d = candidates[quest.next()]
+        if swap and randint(0, 1):
+            n, d = d, n
+        yield randint(min_freq, max_freq), n, d
+
+
+def quest_answered(quest, candidates, positive):
+    def answered(trial, inp):
+        _, n, d = trial
+        quest.update(candidates.index((max(n, d), min(n, d))), positive(n, d, inp))
+    return answered
+
+
+def print_threshold(quest):
+    threshold, sd = quest.threshold()
+    print(f'# Threshold: {threshold:.1f} cents (log10 sd {sd:.3f}) after {quest.trials} trials')
+
+
+def run_trials(instrument, trials, lines, o, rd, port=None, answered=None):
+    stimulus = Stimulus(instrument, port)
+    prepare = lambda trial: stimulus.prepare(lines(*trial))
+    if answered is None:
+        scheduled = prefetch(prepare, trials)
+    else:
+        scheduled = ((trial, prepare(trial)) for trial in trials)
+    try:
+        for (freq, n, d), schedule in scheduled:
+            while True:
+                presented = stimulus.present(schedule)
+                try:
+                    inp = rd()
+                except (KeyboardInterrupt, EOFError):
+                    print('# exiting')
+                    return
+                responded = stimulus.now()
+                if inp is not None:
+                    o.send([
+                        instrument,
+                        n, d, freq, 1.0*n/d*freq,
+                        inp.value, presented, responded
+                    ])
+                    if answered is not None:
+                        answered((freq, n, d), inp)
+                    break
+    finally:
+        stimulus.close()
+
+
 def run_min_interval(
     instrument=82, min_freq=110, max_freq=440,
     d_nums=(1, 2, 3, 4, -1, -2, -3, -4), dens=(128, ),
-    cutoff_min=0.5, cutoff_max=1.5
+    cutoff_min=0.5, cutoff_max=1.5, port=None,
+    adaptive=False, trials=40, precision=PRECISION
 ):
     candidates = [(d+d_n, d) for d_n in d_nums for d in dens]
     shuffle(candidates)
-    g = midi_g_sep(instrument)
-    next(g)
-    o = output('min_interval.res')
+    o = results.output('min_interval.bres', 'min')
     next(o)
     rd = partial(
         read_custom_input,
@@ -124,51 +238,34 @@ def run_min_interval(
         },
         '# z: first tone higer; x: unison; c: second tone higher\n'
     )
-
-    running = True
-    for candidate in candidates:
-        if not running:
-            try:
-                g.send(None)
-            except StopIteration:
-                pass
-            break
-        freq = randint(min_freq, max_freq)
-        n, d = candidate
-        if randint(0, 1):
-            n, d = d, n
-        if not (cutoff_min <= n/d <= cutoff_max):
-            if not (cutoff_min <= d/n <= cutoff_max):
-                print(f'# Skipping {n}/{d} because false {cutoff_min} <= {n/d} <= {cutoff_max}')
-                continue
-            n, d = d, n
-        while True:
-            g.send((freq, n, d))
-            try:
-                inp = rd()
-            except KeyboardInterrupt:
-                print('# exiting')
-                running = False
-                break
-            if inp is not None:
-                o.send([
-                    instrument,
-                    n, d, freq, 1.0*n/d*freq,
-                    inp.value
-                ])
-                break
+    if not adaptive:
+        trials = list(min_trials(candidates, min_freq, max_freq, cutoff_min, cutoff_max))
+        run_trials(instrument, trials, separate_lines, o, rd, port)
+        print('# All done!')
+        return
+    candidates = sorted({
+        (d+abs(d_n), d) for d_n in d_nums for d in dens
+        if d_n and (d+abs(d_n))/d <= cutoff_max and d/(d+abs(d_n)) >= cutoff_min
+    })
+    # Three keys, so a third of blind answers are right
+    quest = Quest([cents(n, d) for n, d in candidates], guess=1/3, precision=precision)
+    correct = lambda n, d, inp: (n > d) - (n < d) == inp.value
+    run_trials(
+        instrument, adaptive_trials(quest, candidates, min_freq, max_freq, trials, swap=True),
+        separate_lines, o, rd, port, quest_answered(quest, candidates, correct)
+    )
+    print_threshold(quest)
     print('# All done!')
 
 
 def run_max_interval(
     instrument=82, min_freq=110, max_freq=440,
-    nums=range(17, 63), dens=(16, )
+    nums=range(17, 63), dens=(16, ), port=None,
+    adaptive=False, trials=40, precision=PRECISION
 ):
     candidates = [(n, d) for n in nums for d in dens]
     shuffle(candidates)
-    g = midi_g(instrument)
-    next(g)
-    o = output('max_interval.res')
+    o = results.output('max_interval.bres', 'max')
     next(o)
     rd = partial(
         read_custom_input,
@@ -178,33 +275,44 @@ def run_max_interval(
         },
         '# z: sounds like an interval; c: sounds like two notes\n'
     )
-
-    running = True
-    for n, d in candidates:
-        if not running:
-            try:
-                g.send(None)
-            except StopIteration:
-                pass
-            break
-        freq = randint(min_freq, max_freq)
-        while True:
-            g.send((freq, n, d))
-            try:
-                inp = rd()
-            except KeyboardInterrupt:
-                print('# exiting')
-                running = False
-                break
-            if inp is not None:
-                o.send([
-                    instrument,
-                    n, d, freq, 1.0*n/d*freq,
-                    inp.value
-                ])
-                break
+    if not adaptive:
+        trials = [(randint(min_freq, max_freq), n, d) for n, d in candidates]
+        run_trials(instrument, trials, together_lines, o, rd, port)
+        print('# All done!')
+        return
+    candidates.sort()
+    quest = Quest([cents(n, d) for n, d in candidates], precision=precision)
+    two_notes = lambda n, d, inp: inp == Choice.right
+    run_trials(
+        instrument, adaptive_trials(quest, candidates, min_freq, max_freq, trials),
+        together_lines, o, rd, port, quest_answered(quest, candidates, two_notes)
+    )
+    print_threshold(quest)
     print('# All done!')
 
 
+EXPERIMENTS = {
+    'compare': run_compare_intervals,
+    'min': run_min_interval,
+    'max': run_max_interval,
+}
+
+
 if __name__ == "__main__":
-    run_max_interval()
+    parser = argparse.ArgumentParser('Run a listening test')
+    parser.add_argument("experiment", choices=tuple(EXPERIMENTS), nargs="?", default='max', help='Which test to run')
+    add_port(parser)
+    parser.add_argument("--adaptive", action='store_true', help='Pick each min/max stimulus from the answers so far instead of a fixed grid')
+    parser.add_argument("--trials", type=int, default=40, help='Most trials in adaptive mode')
+    parser.add_argument("--precision", type=float, default=PRECISION, help='Stop adaptive mode once the log10 threshold sd is below this')
+    args = parser.parse_args()
+    options = {}
+    if args.adaptive:
+        if args.experiment == 'compare':
+            parser.error('--adaptive only applies to the min and max tests')
+        options.update(adaptive=True, trials=args.trials, precision=args.precision)
+    port = open_port(args.port)
+    try:
+        EXPERIMENTS[args.experiment](port=port, **options)
+    finally:
+        port.close()
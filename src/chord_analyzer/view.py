@@ -1,60 +1,141 @@
 from collections import defaultdict
+import io
+import json
 from operator import itemgetter
+import os
+import zlib
 
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
+from . import results
 
-def cmp(a, b):
-    if a > b:
-        return 1
-    if a < b:
-        return -1
-    return 0
+
+EPSILON = 1e-9
+CHUNK = 1 << 22
+HEAD = 4096
+STATE = '.agg.json'
+STATE_VERSION = 2
+
+MIN_HEADER = ('instrument', 'n', 'd', 'freq_1', 'freq_2', 'answer')
+MAX_HEADER = ('instrument', 'n', 'd', 'freq_1', 'freq_2', 'answer')
+
+
+def bucket_index(values, step=0.01):
+    return np.floor(values / step + EPSILON).astype(np.int64)
 
 
 def bucketize(data, key_name, step=0.01):
-    buckets = defaultdict(list)
-    for _, row in data.iterrows():
-        x = row[key_name]
-        bucket = x / step
-        buckets[bucket].append((x, row))
-    return buckets
+    return bucket_index(data[key_name], step) * step
+
+
+def aggregate(data, key_name, value_name, step=0.01):
+    grouped = data.groupby(bucketize(data, key_name, step))[value_name].agg(['mean', 'count'])
+    return pd.DataFrame({
+        "ratio": grouped.index.to_numpy(),
+        value_name: grouped["mean"].to_numpy(),
+        "count": grouped["count"].to_numpy(),
+    }).sort_values(by="ratio", ignore_index=True)
+
+
+def min_rows(data):
+    return pd.DataFrame({
+        "delta": np.abs(1 - data["n"] / data["d"]),
+        "result": (np.sign(data["n"] - data["d"]) == data["answer"]).astype(int),
+    })
+
+
+def max_rows(data):
+    return pd.DataFrame({
+        "delta": np.abs(1 - data["n"] / data["d"]),
+        "is_interval": (data["answer"] < 0).astype(int),
+    })
+
+
+def read_chunks(filename, header, offset=0, chunk=CHUNK, partial=False):
+    # Only whole lines are consumed, so a row still being appended is picked up next time;
+    # partial also reads an unterminated last row, for one-off reads that keep no state
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        tail = b''
+        while block := f.read(chunk):
+            block = tail + block
+            end = block.rfind(b'\n') + 1
+            tail = block[end:]
+            if end:
+                offset += end
+                yield offset, pd.read_csv(io.BytesIO(block[:end]), header=None, names=header)
+        if partial and tail.strip():
+            yield offset + len(tail), pd.read_csv(io.BytesIO(tail), header=None, names=header)
+
+
+def file_head(filename, size):
+    with open(filename, 'rb') as f:
+        return zlib.crc32(f.read(min(size, HEAD)))
+
 
+def empty_state(header, step):
+    return {
+        'version': STATE_VERSION, 'header': list(header), 'step': step,
+        'offset': 0, 'head': 0, 'sums': {}, 'counts': {},
+    }
 
-def get_min_data(filename='min_interval.res', header=('instrument', 'n', 'd', 'freq_1', 'freq_2', 'answer')):
-    data = pd.read_csv(
-        filename,
-        header=None,
-        names=header
-    )
-    gr = pd.DataFrame()
-    gr["delta"] = data.apply(lambda r: abs(1 - r["n"]/r["d"]), axis=1)
-    gr["correct"] = data.apply(lambda r: int(cmp(r["n"], r["d"]) == r["answer"]), axis=1)
-    gr["n"] = data["n"]
-    gr["d"] = data["d"]
-    gr["freq"] = data["freq_1"]
-    r = []
-    for k, values in bucketize(gr, "delta").items():
-        r.append((k, sum(v[1]["correct"] for v in values)/len(values)))
-    return pd.DataFrame(r, columns=("ratio", "result")).sort_values(by="ratio")
-
-def get_max_data(filename='max_interval.res', header=('instrument', 'n', 'd', 'freq_1', 'answer')):
-    data = pd.read_csv(
-        filename,
-        header=None,
-        names=header
-    )
-    gr = pd.DataFrame()
-    gr["delta"] = data.apply(lambda r: abs(1 - r["n"]/r["d"]), axis=1)
-    gr["is_interval"] = data.apply(lambda r: int(r["answer"]<0), axis=1)
-    gr["n"] = data["n"]
-    gr["d"] = data["d"]
-    gr["freq"] = data["freq_1"]
-    r = []
-    for k, values in bucketize(gr, "delta").items():
-        r.append((k, sum(v[1]["is_interval"] for v in values)/len(values)))
-    return pd.DataFrame(r, columns=("ratio", "is_interval")).sort_values(by="ratio")
+
+def load_state(path, filename, header, step):
+    if not os.path.exists(path):
+        return empty_state(header, step)
+    with open(path) as f:
+        state = json.load(f)
+    # Sums from an older layout or another column order would be silently wrong, so start over
+    if (
+        state.get('version') != STATE_VERSION
+        or state.get('header') != list(header)
+        or state['step'] != step
+        or state['offset'] > os.path.getsize(filename)
+        or state['head'] != file_head(filename, state['offset'])
+    ):
+        return empty_state(header, step)
+    return state
+
+
+def save_state(path, filename, state):
+    state['head'] = file_head(filename, state['offset'])
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def aggregate_file(filename, header, rows, value_name, step=0.01, persist=True):
+    if results.is_binary(filename):
+        return aggregate(rows(results.read(filename)), "delta", value_name, step)
+    path = f'{filename}.{value_name}{STATE}'
+    state = load_state(path, filename, header, step) if persist else empty_state(header, step)
+    start = state['offset']
+    sums, counts = state['sums'], state['counts']
+    for offset, data in read_chunks(filename, header, start, partial=not persist):
+        state['offset'] = offset
+        gr = rows(data)
+        grouped = gr[value_name].groupby(bucket_index(gr["delta"], step)).agg(['sum', 'count'])
+        for b, total, n in zip(grouped.index.tolist(), grouped["sum"].tolist(), grouped["count"].tolist()):
+            sums[str(b)] = sums.get(str(b), 0) + total
+            counts[str(b)] = counts.get(str(b), 0) + n
+    if persist and state['offset'] != start:
+        save_state(path, filename, state)
+    buckets = sorted(counts, key=int)
+    return pd.DataFrame({
+        "ratio": np.array([int(b) for b in buckets], dtype=np.int64) * step,
+        value_name: np.array([sums[b] / counts[b] for b in buckets], dtype=float),
+        "count": np.array([counts[b] for b in buckets], dtype=np.int64),
+    })
+
+
+def get_min_data(filename='min_interval.res', header=MIN_HEADER, step=0.01, persist=True):
+    return aggregate_file(filename, header, min_rows, "result", step, persist)
+
+
+def get_max_data(filename='max_interval.res', header=MAX_HEADER, step=0.01, persist=True):
+    return aggregate_file(filename, header, max_rows, "is_interval", step, persist)
 
 
 def into_buckets(data, step, x_getter, y_getter):
@@ -67,8 +148,25 @@ def into_buckets(data, step, x_getter, y_getter):
     return buckets
 
 
-if __name__ == "__main__":
-    df = get_max_data()
+def default_file(kind):
+    binary = f'{kind}_interval{results.SUFFIX}'
+    return binary if os.path.exists(binary) else f'{kind}_interval.res'
+
+
+def plot(kind='max', filename=None):
+    import matplotlib.pyplot as plt
+
+    filename = filename or default_file(kind)
+    match kind:
+        case 'min':
+            df, y = get_min_data(filename), "result"
+        case 'max':
+            df, y = get_max_data(filename), "is_interval"
     plt.close('all')
-    df.plot("ratio", "is_interval")
+    df.plot("ratio", y)
     plt.show()
+
+
+if __name__ == "__main__":
+    plot()
+
@@ -0,0 +1,34 @@
+# SPDX-FileCopyrightText: 2024-present ILJICH <iljich@iljich.name>
+#
+# SPDX-License-Identifier: MIT
+import pytest
+
+from chord_analyzer import analyze
+from chord_analyzer.analyze import get_harmonics, harmonics, reduce
+
+SIZE = 64
+
+
+@pytest.mark.parametrize('d', range(1, SIZE + 1))
+def test_harmonics_match_reduce(d):
+    for n in range(d, 2 * SIZE + 1):
+        assert harmonics(n, d) == tuple(reduce(*range(d + 1, n + 1))), (n, d)
+
+
+def test_get_harmonics_returns_a_fresh_list():
+    result = get_harmonics(12, 5)
+    result.append(0)
+    assert get_harmonics(12, 5) == list(harmonics(12, 5))
+
+
+def test_cache_from_another_version_is_recomputed(tmp_path, monkeypatch):
+    expected = analyze.resolutions(8, cache=None, workers=1)
+    analyze.resolutions(8, cache=str(tmp_path), workers=1)
+    monkeypatch.setattr(analyze, 'CACHE_VERSION', analyze.CACHE_VERSION + 1)
+    computed = []
+    compute = analyze.compute
+    monkeypatch.setattr(analyze, 'compute', lambda *args: computed.append(args[1:3]) or compute(*args))
+    assert analyze.resolutions(8, cache=str(tmp_path), workers=1) == expected
+    assert computed == [(0, 9)]
+    assert analyze.resolutions(8, cache=str(tmp_path), workers=1) == expected
+    assert computed == [(0, 9)]
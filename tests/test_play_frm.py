@@ -0,0 +1,94 @@
+# SPDX-FileCopyrightText: 2024-present ILJICH <iljich@iljich.name>
+#
+# SPDX-License-Identifier: MIT
+import pytest
+
+from chord_analyzer.clock import VirtualClock
+from chord_analyzer.play_frm import ChannelRegistry, Compiler, FrmPlayer, Sleep, Sync, get_parser
+from chord_analyzer.ports import RecordingPort
+
+
+@pytest.fixture(scope='module')
+def parser():
+    return get_parser()
+
+
+def timing(parser, score):
+    return [
+        event for event in Compiler().compile(parser.parse(score))
+        if isinstance(event, (Sleep, Sync))
+    ]
+
+
+@pytest.mark.parametrize('score, expected', [
+    ('sync b\n', [Sync(0.0)]),
+    ('sl 1/4\nsync b\n', [Sleep(0.5), Sync(2.0)]),
+    ('sl 4/4\nsync b\n', [Sleep(2.0), Sync(2.0)]),
+    ('sl 5/4\nsync b\n', [Sleep(2.5), Sync(4.0)]),
+    ('sl 1/4\nbpm 60\nsync b\n', [Sleep(0.5), Sync(3.5)]),
+    ('bpm 60\nsl 1/2\nbpm 240\nsync b\nsl 1/4\n', [Sleep(2.0), Sync(2.5), Sleep(0.25)]),
+    ('sig 3/4\nsl 1/4\nsync b\n', [Sleep(0.5), Sync(1.5)]),
+    ('sig 3/4\nsl 1/4\nsig 4/4\nsl 1/4\nsync b\n', [Sleep(0.5), Sleep(0.5), Sync(2.0)]),
+    ('sl 3/4\nsig 2/4\nsync b\n', [Sleep(1.5), Sync(2.0)]),
+    ('sig 6/8\nsl 1/8\nsync b\nsl 1/8\nsync b\n', [Sleep(0.5), Sync(3.0), Sleep(0.5), Sync(6.0)]),
+])
+def test_sync_targets_the_next_bar_line(parser, score, expected):
+    assert timing(parser, 'bpm 120\n' + score) == expected
+
+
+def test_rewind_restarts_the_bar(parser):
+    compiler = Compiler()
+    list(compiler.compile(parser.parse('sl 1/4\n')))
+    compiler.rewind()
+    assert list(compiler.compile(parser.parse('sl 1/4\nsync b\n'))) == [Sleep(0.5), Sync(2.0)]
+
+
+def test_clock_waits_for_the_sync_target(parser):
+    clock = VirtualClock()
+    player = FrmPlayer(parser, clock=clock, port=RecordingPort(clock))
+    player.process('bpm 120\nsl 1/4\nbpm 60\nsync b\nsl 1/4\n')
+    assert clock.position == 4.5
+
+
+def check_channels(port):
+    sounding = {}
+    for _, msg in port.messages():
+        match msg.type:
+            case 'note_on':
+                assert msg.channel not in sounding, f'note_on on busy channel {msg.channel}'
+                sounding[msg.channel] = msg.note
+            case 'note_off':
+                assert sounding.pop(msg.channel) == msg.note
+    return sounding
+
+
+def test_stealing_silences_the_victim_first(parser):
+    clock = VirtualClock()
+    port = RecordingPort(clock)
+    player = FrmPlayer(parser, clock=clock, port=port)
+    names = [f'n{k}' for k in range(1, 21)]
+    player.process(
+        'f=55\n'
+        + ''.join(f'{name}=f:0@{k}\n' for k, name in enumerate(names, 1))
+        + ''.join(f'{name}+\n' for name in names)
+        + 'sl 1/4\n'
+        + ''.join(f'{name}-\n' for name in names)
+    )
+    assert check_channels(port) == {}
+    assert player.channels.stats() == {'active': 0, 'peak': 16, 'steals': 4}
+
+
+def test_stealing_across_players_sends_the_note_off_with_the_thief(parser):
+    clock = VirtualClock()
+    port = RecordingPort(clock)
+    channels = ChannelRegistry(max_channels=1)
+    first, second = (FrmPlayer(parser, clock=clock, port=port, channels=channels) for _ in range(2))
+    first.process('f=220\na=f:0@1\na+\n')
+    second.process('f=330\nb=f:0@1\nb+\n')
+    first.process('a-\n')
+    assert check_channels(port) == {0: 64}
+    second.process('b-\n')
+    assert [msg.type for _, msg in port.messages() if msg.type.startswith('note')] == [
+        'note_on', 'note_off', 'note_on', 'note_off',
+    ]
+    assert channels.stats()['steals'] == 1
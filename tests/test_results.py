@@ -0,0 +1,30 @@
+# SPDX-FileCopyrightText: 2024-present ILJICH <iljich@iljich.name>
+#
+# SPDX-License-Identifier: MIT
+import numpy as np
+
+from chord_analyzer import results
+
+
+def test_convert_reads_choice_answers(tmp_path):
+    source = tmp_path / '1.res'
+    source.write_text(
+        '82,9,4,495.0,9,4,495.0,Choice.left\n'
+        '82,13,5,572.0,14,5,616.0,Choice.equal\n'
+        '82,7,3,513.3333333333334,8,3,586.6666666666666,Choice.right\n'
+        '82,3,2,330.0,5,4,275.0,1\n'
+    )
+    data = results.read(results.convert(str(source)))
+    assert data.dtype == results.SCHEMAS['compare']
+    assert data['answer'].tolist() == [-1, 0, 1, 1]
+    assert data['n_2'].tolist() == [9, 14, 8, 5]
+    assert data['freq_2'][1] == 616.0
+    assert np.isnan(data['presented']).all()
+
+
+def test_convert_reads_numeric_answers(tmp_path):
+    source = tmp_path / 'min_interval.res'
+    source.write_text('82,2,11,440,80.0,-1\n82,1,5,212,42.400000000000006,1\n')
+    data = results.read(results.convert(str(source)))
+    assert data['answer'].tolist() == [-1, 1]
+    assert data['freq_1'].tolist() == [440.0, 212.0]
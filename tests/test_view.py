@@ -0,0 +1,21 @@
+# SPDX-FileCopyrightText: 2024-present ILJICH <iljich@iljich.name>
+#
+# SPDX-License-Identifier: MIT
+from chord_analyzer import view
+
+ROWS = '82,2,11,440,80.0,-1\n82,1,5,212,42.4,1'
+
+
+def test_unterminated_row_is_read_without_state(tmp_path):
+    source = tmp_path / 'min_interval.res'
+    source.write_text(ROWS)
+    assert view.get_min_data(str(source), persist=False)['count'].sum() == 2
+
+
+def test_unterminated_row_waits_for_its_newline_with_state(tmp_path):
+    source = tmp_path / 'min_interval.res'
+    source.write_text(ROWS)
+    assert view.get_min_data(str(source))['count'].sum() == 1
+    with open(source, 'a') as f:
+        f.write('\n')
+    assert view.get_min_data(str(source))['count'].sum() == 2